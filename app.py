@@ -1,16 +1,27 @@
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from db import get_db_uri, delete_data_by_date, get_lists_of_cost_centers_by_segmentation, get_lists_of_cost_centers_by_management_mode
+from db import get_db_uri, delete_data_by_date, delete_file_rows, get_lists_of_cost_centers, get_invariants_cache_stats, table_exists
 from init import init_db
+from jobs import JobQueue, JobCancelled
+from constants import HSE_SCORE_COLUMNS
+from validation import validate_report_workbook
 from flask_cors import CORS
 import os
 from werkzeug.utils import secure_filename
 from datetime import datetime
 from flask import send_from_directory
+from flask.helpers import get_debug_flag
 from werkzeug.security import safe_join
-import subprocess
 import sys
+import hashlib
+import json
+import shutil
+import threading
+import time
+import uuid
+from datetime import timedelta
+from collections import OrderedDict
 from sqlalchemy import text
 
 
@@ -18,7 +29,22 @@ app = Flask(__name__)
 CORS(app)
 
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
-ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
+# feuilles analysees des fichiers deposes, par hash du contenu (ecrit par scripts/sheet_cache.py)
+SHEET_CACHE_DIR = os.getenv("SHEET_CACHE_DIR", os.path.join(os.getcwd(), 'cache', 'sheets'))
+# seuls les classeurs .xlsx sont extraits (feuilles Inspections, Questions, HSE Invariants)
+ALLOWED_EXTENSIONS = {'xlsx'}
+# fichiers en cours de depot par morceaux (hors de UPLOAD_FOLDER, qui est servi par /uploads)
+UPLOAD_PARTS_FOLDER = os.getenv("UPLOAD_PARTS_FOLDER", os.path.join(os.getcwd(), 'cache', 'upload_parts'))
+# taille des blocs lus dans le corps des requetes de depot
+UPLOAD_READ_BLOCK_BYTES = 1024 * 1024
+# une session de depot sans nouveau morceau depuis ce delai est abandonnee
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24))
+# parametres du tableau de bord convertis en codes de station via la feuille Invariants
+INVARIANTS_FILTER_PARAMS = ('management_mode', 'segmentation')
+# cache des reponses de /get-statistics-by-filter
+STATS_CACHE_MAX_ENTRIES = int(os.getenv("STATS_CACHE_MAX_ENTRIES", 512))
+STATS_CACHE_TTL_SECONDS = int(os.getenv("STATS_CACHE_TTL_SECONDS", 600))
+STATS_CACHE_KEY_PARAMS = ('date', 'zone', 'sub_zone', 'affiliate', 'station_code', 'station_name') + INVARIANTS_FILTER_PARAMS
 
 app.config['SQLALCHEMY_DATABASE_URI'] = get_db_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -26,6 +52,7 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
+os.makedirs(UPLOAD_PARTS_FOLDER, exist_ok=True)
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
@@ -44,9 +71,24 @@ class FileUploads(db.Model):
     filetype = db.Column(db.String(100), nullable=False)
     file_size = db.Column(db.String(50), nullable=False)
     date_created = db.Column(db.Date, nullable=False)
+    file_status = db.Column(db.String(100), nullable=False, server_default='pending')
+    content_hash = db.Column(db.String(64), nullable=True)
     upload_date = db.Column(db.DateTime, server_default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), server_onupdate=db.func.current_timestamp())
 
+class UploadSessions(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    filetype = db.Column(db.String(100), nullable=False)
+    date_created = db.Column(db.Date, nullable=True)
+    expected_size = db.Column(db.BigInteger, nullable=True)
+    received_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='open')
+    file_upload_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), server_onupdate=db.func.current_timestamp())
+
 # initializer la base de données
 with app.app_context():
     init_db(app, db, bcrypt)
@@ -60,6 +102,134 @@ def format_to_k(num: int) -> str:
         return f"{num / 1000:.2f}k"
     return str(num)
 
+def stream_to_file(stream, file_obj, sha256):
+    """ copie un flux dans un fichier par blocs en mettant a jour le hash SHA-256; renvoie le nombre d'octets ecrits """
+    written = 0
+    for block in iter(lambda: stream.read(UPLOAD_READ_BLOCK_BYTES), b''):
+        file_obj.write(block)
+        sha256.update(block)
+        written += len(block)
+    return written
+
+def format_file_size(size_bytes):
+    return f"{size_bytes / (1024*1024):.4f} MB"
+
+def parse_date_created(date_created_str):
+    """ date de rapport 'YYYY-MM-DD' des parametres de depot; ValueError si invalide """
+    return datetime.strptime(date_created_str, '%Y-%m-%d').date()
+
+def find_duplicate_upload(content_hash, date_created):
+    """ fichier deja depose avec le meme contenu pour la meme date de rapport """
+    return FileUploads.query.filter(
+        FileUploads.content_hash == content_hash,
+        FileUploads.date_created == date_created,
+        FileUploads.file_status != 'deleting'
+    ).first()
+
+def register_upload(part_path, filename, filetype, user_id, date_created, content_hash, size_bytes):
+    """ publie un fichier recu (deja hache) dans UPLOAD_FOLDER, l'enregistre et planifie l'analyse de ses feuilles """
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    shutil.move(part_path, filepath)
+
+    new_upload = FileUploads(
+        user_id=user_id,
+        filename=filename,
+        filetype=filetype,
+        file_size=format_file_size(size_bytes),
+        date_created=date_created,
+        content_hash=content_hash
+    )
+    db.session.add(new_upload)
+    db.session.commit()
+
+    # analyse des feuilles en arriere-plan: l'extraction lira le cache au lieu du .xlsx
+    parse_job_id = job_queue.enqueue('parse', payload={
+        "file_id": new_upload.id,
+        "filename": filename,
+        "content_hash": new_upload.content_hash
+    }, user_id=new_upload.user_id)
+    return new_upload, filepath, parse_job_id
+
+def duplicate_upload_response(duplicate):
+    return jsonify({
+        "error": "Ce fichier a déjà été déposé pour cette date",
+        "duplicate_of": duplicate.id,
+        "filename": duplicate.filename
+    }), 409
+
+def invalid_upload_response(errors):
+    return jsonify({
+        "error": "Fichier refusé: " + "; ".join(errors),
+        "details": errors
+    }), 422
+
+def get_upload_part_path(session_id):
+    return os.path.join(UPLOAD_PARTS_FOLDER, f"{session_id}.part")
+
+# hash SHA-256 en cours par session de depot: {id: [verrou, hasher, octets haches]}
+UPLOAD_HASHERS = {}
+UPLOAD_HASHERS_LOCK = threading.Lock()
+
+def get_upload_hasher(session_id):
+    with UPLOAD_HASHERS_LOCK:
+        if session_id not in UPLOAD_HASHERS:
+            UPLOAD_HASHERS[session_id] = [threading.Lock(), hashlib.sha256(), 0]
+        return UPLOAD_HASHERS[session_id]
+
+def drop_upload_hasher(session_id):
+    with UPLOAD_HASHERS_LOCK:
+        UPLOAD_HASHERS.pop(session_id, None)
+
+def sync_upload_hasher(state, part_path, received_bytes):
+    """ apres un redemarrage ou une reprise, recalcule le hash des octets deja recus (seul cas de relecture) """
+    if state[2] == received_bytes:
+        return
+    sha256 = hashlib.sha256()
+    with open(part_path, 'rb') as part_file:
+        remaining = received_bytes
+        while remaining:
+            block = part_file.read(min(UPLOAD_READ_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            sha256.update(block)
+            remaining -= len(block)
+    state[1], state[2] = sha256, received_bytes
+
+def expire_upload_sessions():
+    """ supprime les sessions de depot ouvertes sans activite depuis UPLOAD_SESSION_TTL_HOURS """
+    cutoff = datetime.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    expired = UploadSessions.query.filter(UploadSessions.status == 'open', UploadSessions.updated_at < cutoff).all()
+    for upload_session in expired:
+        upload_session.status = 'expired'
+        drop_upload_hasher(upload_session.id)
+        part_path = get_upload_part_path(upload_session.id)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    db.session.commit()
+    if expired:
+        print(f"{len(expired)} session(s) de dépôt expirée(s)")
+
+def get_upload_session_or_error(session_id, user_id, require_open=True):
+    upload_session = db.session.get(UploadSessions, session_id)
+    if not upload_session:
+        return None, (jsonify({"error": "Session de dépôt introuvable"}), 404)
+    if upload_session.user_id != user_id:
+        return None, (jsonify({"error": "Vous n'êtes pas autorisé à accéder à ce dépôt"}), 403)
+    if require_open and upload_session.status != 'open':
+        return None, (jsonify({"error": f"Session de dépôt {upload_session.status}", "status": upload_session.status}), 409)
+    return upload_session, None
+
+def remove_sheet_cache(content_hash):
+    """ supprime les feuilles en cache d'un contenu qui n'est plus reference par aucun fichier """
+    if not content_hash:
+        return
+    still_used = db.session.execute(
+        text("SELECT COUNT(*) FROM file_uploads WHERE content_hash = :content_hash"),
+        {"content_hash": content_hash}
+    ).scalar()
+    if not still_used:
+        shutil.rmtree(os.path.join(SHEET_CACHE_DIR, content_hash), ignore_errors=True)
+
 # point d'entrée pour cree un utilisateur
 @app.route('/register', methods=['POST'])
 def register():
@@ -112,6 +282,7 @@ def list_files():
             "filetype": f.filetype,
             "file_size": f.file_size,
             "date_created": f.date_created.strftime('%Y-%m-%d'),
+            "file_status": f.file_status,
             "upload_date": f.upload_date.strftime('%Y-%m-%d %H:%M:%S'),
             "updated_at": f.updated_at.strftime('%Y-%m-%d %H:%M:%S')
         } for f in files
@@ -132,39 +303,240 @@ def upload_file():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        stat_info = os.stat(filepath)
-        
-        # Use the date from query params if provided, otherwise use file creation time
+
+        # date des parametres de la requete si fournie, sinon la date du depot
         if date_created_str:
             try:
-                created_at = datetime.strptime(date_created_str, '%Y-%m-%d').strftime('%Y-%m-%d %H:%M:%S')
+                date_created = parse_date_created(date_created_str)
             except ValueError:
                 return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD"}), 400
         else:
-            created_at = datetime.fromtimestamp(stat_info.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
-        
-        size_mb = stat_info.st_size / (1024*1024)
-        file_size_str = f"{size_mb:.4f} MB"
-
-        new_upload = FileUploads(
-            user_id=user_id,
-            filename=filename,
-            filetype=file.content_type,
-            file_size=file_size_str,
-            date_created=created_at
+            date_created = datetime.now().date()
+
+        # ecrit et hache en un seul passage, sans relire le fichier
+        part_path = os.path.join(UPLOAD_PARTS_FOLDER, f"{uuid.uuid4().hex}.part")
+        sha256 = hashlib.sha256()
+        with open(part_path, 'wb') as part_file:
+            size_bytes = stream_to_file(file.stream, part_file, sha256)
+        content_hash = sha256.hexdigest()
+
+        duplicate = find_duplicate_upload(content_hash, date_created)
+        if duplicate:
+            os.remove(part_path)
+            return duplicate_upload_response(duplicate)
+
+        # feuilles et en-tetes verifies avant la creation de la ligne 'pending': pas d'extraction sur un fichier invalide
+        errors = validate_report_workbook(part_path)
+        if errors:
+            os.remove(part_path)
+            return invalid_upload_response(errors)
+
+        new_upload, filepath, parse_job_id = register_upload(
+            part_path, filename, file.content_type, user_id, date_created, content_hash, size_bytes
         )
-        db.session.add(new_upload)
-        db.session.commit()
 
         return jsonify({
             "message": "Fichier uploadé avec succès",
             "filename": filename,
-            "path": filepath
+            "path": filepath,
+            "parse_job_id": parse_job_id
         }), 201
     else:
-        return jsonify({"error": "Une erreur s'est produite. Veuillez vérifier le type/taille (csv uniquement) du fichier puis réessayer."}), 400
+        return jsonify({"error": "Type de fichier non autorisé: seuls les classeurs Excel (.xlsx) sont acceptés."}), 400
+
+@app.route('/upload-sessions', methods=['POST'])
+def init_chunked_upload():
+    """ ouvre un depot par morceaux: le fichier est ensuite envoye par PUT /upload-sessions/<id>, repris a l'offset renvoye """
+    user_id = request.args.get('user_id', type=int)
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+
+    if not user_id:
+        return jsonify({"error": "L'utilisateur n'est pas connecté. Veuillez vous connecter puis réessayer."}), 400
+    if not filename or not allowed_file(filename):
+        return jsonify({"error": "Type de fichier non autorisé: seuls les classeurs Excel (.xlsx) sont acceptés."}), 400
+
+    date_created = None
+    if data.get('date_creation'):
+        try:
+            date_created = parse_date_created(data['date_creation'])
+        except ValueError:
+            return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD"}), 400
+
+    expected_size = data.get('size')
+    if expected_size is not None and (not isinstance(expected_size, int) or expected_size < 0):
+        return jsonify({"error": "Taille de fichier invalide"}), 400
+
+    expire_upload_sessions()
+
+    upload_session = UploadSessions(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=secure_filename(filename),
+        filetype=data.get('filetype') or 'application/octet-stream',
+        date_created=date_created,
+        expected_size=expected_size,
+        received_bytes=0,
+        status='open'
+    )
+    db.session.add(upload_session)
+    db.session.commit()
+    open(get_upload_part_path(upload_session.id), 'wb').close()
+
+    return jsonify({
+        "upload_id": upload_session.id,
+        "offset": 0,
+        "upload_url": f"/upload-sessions/{upload_session.id}"
+    }), 201
+
+@app.route('/upload-sessions/<string:session_id>', methods=['GET'])
+def get_chunked_upload(session_id):
+    user_id = request.args.get('user_id', type=int)
+    # l'etat d'une session terminee reste consultable (file_upload_id), par son proprietaire uniquement
+    upload_session, error = get_upload_session_or_error(session_id, user_id, require_open=False)
+    if error:
+        return error
+    return jsonify({
+        "upload_id": upload_session.id,
+        "filename": upload_session.filename,
+        "status": upload_session.status,
+        "offset": upload_session.received_bytes,
+        "expected_size": upload_session.expected_size,
+        "file_upload_id": upload_session.file_upload_id
+    }), 200
+
+@app.route('/upload-sessions/<string:session_id>', methods=['PUT', 'PATCH'])
+def append_chunked_upload(session_id):
+    """ ajoute le corps de la requete a la fin du fichier; l'offset (en-tete Upload-Offset) doit etre celui du serveur """
+    user_id = request.args.get('user_id', type=int)
+    upload_session, error = get_upload_session_or_error(session_id, user_id)
+    if error:
+        return error
+
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Offset du morceau manquant", "offset": upload_session.received_bytes}), 400
+
+    state = get_upload_hasher(session_id)
+    # un seul morceau a la fois par session; les autres sont refuses plutot que mis en attente
+    if not state[0].acquire(blocking=False):
+        return jsonify({"error": "Un morceau est déjà en cours d'envoi", "offset": upload_session.received_bytes}), 409
+    try:
+        db.session.refresh(upload_session)
+        received_bytes = upload_session.received_bytes
+        if offset != received_bytes:
+            return jsonify({"error": "Offset inattendu, reprenez à l'offset indiqué", "offset": received_bytes}), 409
+
+        part_path = get_upload_part_path(session_id)
+        sync_upload_hasher(state, part_path, received_bytes)
+
+        with open(part_path, 'r+b') as part_file:
+            # les octets d'un morceau interrompu au-dela de l'offset enregistre sont ecrases
+            part_file.truncate(received_bytes)
+            part_file.seek(received_bytes)
+            interrupted = True
+            try:
+                stream_to_file(request.stream, part_file, state[1])
+                interrupted = False
+            finally:
+                part_file.flush()
+                end_offset = part_file.tell()
+                if upload_session.expected_size is not None and end_offset > upload_session.expected_size:
+                    # morceau refuse: le fichier revient a l'offset precedent, le hash sera recalcule
+                    part_file.truncate(received_bytes)
+                    state[2] = None
+                else:
+                    # meme sur une deconnexion, les octets ecrits restent acquis pour la reprise; le hash d'un morceau
+                    # interrompu ne correspond pas forcement au fichier: il est recalcule au prochain morceau
+                    state[2] = None if interrupted else end_offset
+                    upload_session.received_bytes = end_offset
+                    db.session.commit()
+
+        if upload_session.received_bytes != end_offset:
+            return jsonify({"error": "Le fichier dépasse la taille annoncée", "offset": received_bytes}), 413
+
+        return jsonify({"upload_id": session_id, "offset": upload_session.received_bytes}), 200
+    finally:
+        state[0].release()
+
+@app.route('/upload-sessions/<string:session_id>/complete', methods=['POST'])
+def complete_chunked_upload(session_id):
+    """ termine le depot: le hash calcule pendant l'envoi detecte les doublons sans relire le fichier """
+    user_id = request.args.get('user_id', type=int)
+    upload_session, error = get_upload_session_or_error(session_id, user_id)
+    if error:
+        return error
+
+    state = get_upload_hasher(session_id)
+    if not state[0].acquire(blocking=False):
+        return jsonify({"error": "Un morceau est déjà en cours d'envoi", "offset": upload_session.received_bytes}), 409
+    try:
+        db.session.refresh(upload_session)
+        if upload_session.expected_size is not None and upload_session.received_bytes != upload_session.expected_size:
+            return jsonify({
+                "error": "Fichier incomplet",
+                "offset": upload_session.received_bytes,
+                "expected_size": upload_session.expected_size
+            }), 409
+
+        part_path = get_upload_part_path(session_id)
+        sync_upload_hasher(state, part_path, upload_session.received_bytes)
+        content_hash = state[1].hexdigest()
+        date_created = upload_session.date_created or datetime.now().date()
+
+        duplicate = find_duplicate_upload(content_hash, date_created)
+        if duplicate:
+            os.remove(part_path)
+            upload_session.status = 'duplicate'
+            upload_session.file_upload_id = duplicate.id
+            db.session.commit()
+            drop_upload_hasher(session_id)
+            return duplicate_upload_response(duplicate)
+
+        errors = validate_report_workbook(part_path)
+        if errors:
+            os.remove(part_path)
+            upload_session.status = 'rejected'
+            db.session.commit()
+            drop_upload_hasher(session_id)
+            return invalid_upload_response(errors)
+
+        new_upload, filepath, parse_job_id = register_upload(
+            part_path, upload_session.filename, upload_session.filetype, upload_session.user_id,
+            date_created, content_hash, upload_session.received_bytes
+        )
+        upload_session.status = 'completed'
+        upload_session.file_upload_id = new_upload.id
+        db.session.commit()
+        drop_upload_hasher(session_id)
+    finally:
+        state[0].release()
+
+    return jsonify({
+        "message": "Fichier uploadé avec succès",
+        "filename": new_upload.filename,
+        "path": filepath,
+        "file_id": new_upload.id,
+        "content_hash": content_hash,
+        "parse_job_id": parse_job_id
+    }), 201
+
+@app.route('/upload-sessions/<string:session_id>', methods=['DELETE'])
+def abort_chunked_upload(session_id):
+    user_id = request.args.get('user_id', type=int)
+    upload_session, error = get_upload_session_or_error(session_id, user_id)
+    if error:
+        return error
+
+    upload_session.status = 'aborted'
+    db.session.commit()
+    drop_upload_hasher(session_id)
+    part_path = get_upload_part_path(session_id)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    return jsonify({"message": "Dépôt annulé", "upload_id": session_id}), 200
 
 @app.route('/delete-file/<int:file_id>', methods=['DELETE'])
 def delete_file(file_id):
@@ -181,45 +553,78 @@ def delete_file(file_id):
     if file_record.user_id != user_id:
         return jsonify({"error": "Vous n'êtes pas autorisé à supprimer ce fichier"}), 403
 
-    filepath = os.path.join(UPLOAD_FOLDER, secure_filename(file_record.filename))
-    if os.path.exists(filepath):
-        try:
-            os.remove(filepath)
-            delete_data_by_date(db, file_record.date_created)
-        except Exception as e:
-            return jsonify({"error": f"Impossible de supprimer le fichier physique: {str(e)}"}), 500
-    else:
-        return jsonify({"warning": "Fichier physique déjà supprimé"}), 200
+    if file_record.file_status == 'processing':
+        return jsonify({"error": "Le fichier est en cours d'extraction, réessayez une fois l'extraction terminée"}), 409
 
+    # le fichier n'est plus reclamable par l'extraction; ses lignes sont supprimees par le job 'delete'
     try:
-        db.session.delete(file_record)
+        # le statut d'avant la suppression dit au job si le fichier a publie des lignes
+        previous_status = file_record.file_status
+        file_record.file_status = 'deleting'
         db.session.commit()
+        job_id = job_queue.enqueue('delete', payload={
+            "file_id": file_record.id,
+            "previous_status": previous_status
+        }, user_id=user_id)
     except Exception as e:
-        return jsonify({"error": f"Impossible de supprimer l'enregistrement en base: {str(e)}"}), 500
+        db.session.rollback()
+        return jsonify({"error": f"Impossible de planifier la suppression du fichier: {str(e)}"}), 500
 
-    return jsonify({"message": "Fichier supprimé avec succès"}), 200
+    return jsonify({
+        "message": "Suppression du fichier ajoutée à la file d'attente",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
 
 
 # recuperer les donnees pour les filtres de la bd
 @app.route('/get-filters', methods=['GET'])
 def get_filters():
+    # meme validation que /get-statistics-by-filter: une date invalide n'est pas un filtre sans resultat
+    date_param = request.args.get('date')
+    query_date = None
+    if date_param:
+        try:
+            query_date = datetime.strptime(date_param, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD"}), 400
+
     try:
-        dates_query = db.session.query(FileUploads.date_created).distinct().all()
-        files_creation_date = [date[0].strftime('%Y-%m-%d') for date in dates_query if date[0]]
+        files_creation_date = []
+        if table_exists(db, "report_dates"):
+            dates_query = db.session.execute(text("SELECT `date` FROM report_dates ORDER BY `date`")).fetchall()
+            files_creation_date = [date[0].strftime('%Y-%m-%d') for date in dates_query if date[0]]
         
         station_codes = []
         station_names = []
         
         try:
+            # filtres optionnels: par date de rapport (rollup, indexe sur la date) et/ou zone/sous-zone
+            source_table = "hse_variant_rollups" if query_date else "stations"
+            conditions = []
+            params = {}
+            if query_date:
+                conditions.append("`date` = :date")
+                params["date"] = query_date
+            if request.args.get('zone'):
+                conditions.append("`zone` = :zone")
+                params["zone"] = request.args.get('zone')
+            if request.args.get('sub_zone'):
+                conditions.append("`sub-zone` = :sub_zone")
+                params["sub_zone"] = request.args.get('sub_zone')
+            scope_sql = "".join([f" AND {condition}" for condition in conditions])
+            
             # Get distinct station codes
             codes_query = db.session.execute(
-                text("SELECT DISTINCT `station code` FROM hse_variants WHERE `station code` IS NOT NULL ORDER BY `station code`")
+                text(f"SELECT DISTINCT `station code` FROM {source_table} WHERE `station code` IS NOT NULL{scope_sql} ORDER BY `station code`"),
+                params
             ).fetchall()
             station_codes = [row[0] for row in codes_query if row[0]]
             
             # Get distinct station names
             names_query = db.session.execute(
-                text("SELECT DISTINCT `station name` FROM hse_variants WHERE `station name` IS NOT NULL ORDER BY `station name`")
+                text(f"SELECT DISTINCT `station name` FROM {source_table} WHERE `station name` IS NOT NULL{scope_sql} ORDER BY `station name`"),
+                params
             ).fetchall()
             station_names = [row[0] for row in names_query if row[0]]
             
@@ -239,6 +644,127 @@ def get_filters():
         }), 500
  
  
+class StatsCache:
+    """ cache LRU + TTL des reponses de /get-statistics-by-filter, par filtres normalises """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # derniere ligne de stats_cache_invalidations appliquee par ce processus
+        self.last_invalidation_id = None
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, payload):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        with self.lock:
+            stale_keys = [key for key in self.entries if predicate(key)]
+            for key in stale_keys:
+                del self.entries[key]
+            self.invalidations += len(stale_keys)
+            return len(stale_keys)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0,
+                "invalidations": self.invalidations
+            }
+
+
+stats_cache = StatsCache(STATS_CACHE_MAX_ENTRIES, STATS_CACHE_TTL_SECONDS)
+
+
+def build_stats_cache_key(query_date, query_params):
+    # (date, filtres...): parametres absents et vides sont equivalents, comme dans compute_stats
+    filters = tuple((param, query_params.get(param) or None) for param in STATS_CACHE_KEY_PARAMS)
+    return (query_date.isoformat(),) + filters
+
+
+def invalidate_stats_cache_for_dates(dates, invariants_changed=False):
+    """ publie l'invalidation dans la base: le job a pu tourner dans un autre processus que celui qui sert les requetes """
+    date_strs = sorted({d.strftime('%Y-%m-%d') if hasattr(d, 'strftime') else str(d) for d in dates})
+    db.session.execute(
+        text("INSERT INTO stats_cache_invalidations (dates, invariants_changed) VALUES (:dates, :invariants_changed)"),
+        {"dates": json.dumps(date_strs), "invariants_changed": int(invariants_changed)}
+    )
+    # au-dela du TTL, plus aucune reponse en cache ne peut etre concernee
+    db.session.execute(
+        text("DELETE FROM stats_cache_invalidations WHERE created_at < NOW() - INTERVAL :retention SECOND"),
+        {"retention": max(2 * STATS_CACHE_TTL_SECONDS, 3600)}
+    )
+    db.session.commit()
+    return apply_stats_cache_invalidations()
+
+
+def apply_stats_cache_invalidations():
+    """ applique au cache de ce processus les invalidations publiees depuis sa derniere lecture """
+    if stats_cache.last_invalidation_id is None:
+        # cache vide au demarrage du processus: seules les invalidations suivantes le concernent
+        stats_cache.last_invalidation_id = db.session.execute(
+            text("SELECT COALESCE(MAX(id), 0) FROM stats_cache_invalidations")
+        ).scalar()
+        return 0
+
+    rows = db.session.execute(
+        text("SELECT id, dates, invariants_changed FROM stats_cache_invalidations WHERE id > :last_id ORDER BY id"),
+        {"last_id": stats_cache.last_invalidation_id}
+    ).fetchall()
+    invalidated = 0
+    for row in rows:
+        invalidated += invalidate_stats_cache_entries(set(json.loads(row.dates)), bool(row.invariants_changed))
+        stats_cache.last_invalidation_id = row.id
+    return invalidated
+
+
+def invalidate_stats_cache_entries(date_strs, invariants_changed):
+    invariants_params = set(INVARIANTS_FILTER_PARAMS)
+
+    def is_stale(key):
+        if key[0] in date_strs:
+            return True
+        # les cost centers rapproches peuvent changer pour toutes les dates quand Invariants.xlsx est reecrit
+        return invariants_changed and any(param in invariants_params and value for param, value in key[1:])
+
+    return stats_cache.invalidate(is_stale)
+
+
+# statistiques des caches du tableau de bord
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "statistics": stats_cache.stats(),
+        "invariants": get_invariants_cache_stats()
+    }), 200
+
+
 # get statistiques pour le dashboard
 @app.route('/get-statistics-by-filter', methods=['GET'])
 def get_stats():
@@ -254,23 +780,34 @@ def get_stats():
     except ValueError:
         return jsonify({"error": "Format de date invalide. Utilisez YYYY-MM-DD"}), 400
     
+    # servi depuis le cache sauf si la date a ete re-extraite/supprimee ou si l'entree a expire
+    cache_key = build_stats_cache_key(query_date, query_params)
+    apply_stats_cache_invalidations()
+    cached_payload = stats_cache.get(cache_key)
+    if cached_payload is not None:
+        return jsonify(cached_payload), 200
+
+    payload, status = compute_stats(query_params, date_param, query_date)
+    if status == 200:
+        stats_cache.set(cache_key, payload)
+    return jsonify(payload), status
+
+
+def compute_stats(query_params, date_param, query_date):
     sub_zone_param = query_params.get('sub_zone')
     zone_param = query_params.get('zone')
     affiliate_param = query_params.get('affiliate')
     station_code_param = query_params.get('station_code')
     station_name_param = query_params.get('station_name')
-    management_mode_param = query_params.get('management_mode')
-    segmentation_param = query_params.get('segmentation')
-    selected_station_codes = []
-    selected_segmentation_station_codes = []
-
-    if( management_mode_param ):
-        selected_station_codes = get_lists_of_cost_centers_by_management_mode(db, management_mode_param)
-    if( segmentation_param ):
-        selected_segmentation_station_codes = get_lists_of_cost_centers_by_segmentation(db, segmentation_param)
+    # filtres Invariants: parametre -> cost centers ayant cette valeur d'attribut
+    invariants_filters = {}
+    for param in INVARIANTS_FILTER_PARAMS:
+        param_value = query_params.get(param)
+        if param_value:
+            invariants_filters[param] = get_lists_of_cost_centers(db, param, param_value)
 
     try:
-        where_conditions = ["DATE(`date`) = :query_date"]
+        where_conditions = ["`date` = :query_date"]
         query_params_dict = {"query_date": query_date}
 
         if sub_zone_param:
@@ -293,61 +830,36 @@ def get_stats():
             where_conditions.append("`station name` = :station_name")
             query_params_dict["station_name"] = station_name_param
         
-        # Filter by management mode station codes
-        if management_mode_param and selected_station_codes:
-            if len(selected_station_codes) > 0:
-                placeholders = ','.join([f':station_code_{i}' for i in range(len(selected_station_codes))])
+        # filtre sur les codes de station de chaque filtre Invariants
+        for param, selected_station_codes in invariants_filters.items():
+            if selected_station_codes:
+                placeholders = ','.join([f':{param}_code_{i}' for i in range(len(selected_station_codes))])
                 where_conditions.append(f"`station code` IN ({placeholders})")
                 for i, code in enumerate(selected_station_codes):
-                    query_params_dict[f'station_code_{i}'] = code
-        
-        # Filter by segmentation station codes
-        if segmentation_param and selected_segmentation_station_codes:
-            if len(selected_segmentation_station_codes) > 0:
-                placeholders = ','.join([f':seg_station_code_{i}' for i in range(len(selected_segmentation_station_codes))])
-                where_conditions.append(f"`station code` IN ({placeholders})")
-                for i, code in enumerate(selected_segmentation_station_codes):
-                    query_params_dict[f'seg_station_code_{i}'] = code
+                    query_params_dict[f'{param}_code_{i}'] = code
         
         where_clause = " AND ".join(where_conditions)
         
-        # Query to get averages for each EP, ES, ET column
+        # moyennes de chaque colonne EP, ES, ET depuis le rollup par station (sommes / comptes)
+        means_sql = ",\n                ".join(
+            [f"SUM(`{col}_sum`) / NULLIF(SUM(`{col}_count`), 0) as {col}_mean" for col in HSE_SCORE_COLUMNS]
+        )
         query = text(f"""
             SELECT 
-                AVG(`ep01`) as ep01_mean, AVG(`ep02`) as ep02_mean, AVG(`ep03`) as ep03_mean,
-                AVG(`ep04`) as ep04_mean, AVG(`ep05`) as ep05_mean, AVG(`ep06`) as ep06_mean,
-                AVG(`ep07`) as ep07_mean, AVG(`ep08`) as ep08_mean, AVG(`ep09`) as ep09_mean,
-                AVG(`ep10`) as ep10_mean, AVG(`ep11`) as ep11_mean,
-                AVG(`es01`) as es01_mean, AVG(`es02`) as es02_mean, AVG(`es03`) as es03_mean,
-                AVG(`es04`) as es04_mean, AVG(`es05`) as es05_mean, AVG(`es06`) as es06_mean,
-                AVG(`es07`) as es07_mean, AVG(`es08`) as es08_mean, AVG(`es09`) as es09_mean,
-                AVG(`et01`) as et01_mean, AVG(`et02`) as et02_mean, AVG(`et03`) as et03_mean,
-                AVG(`et04`) as et04_mean, AVG(`et05`) as et05_mean,
-                SUM(CASE WHEN `zone` = 'AFR' THEN 1 ELSE 0 END) as afr_count,
-                COUNT(*) as total_records
-            FROM hse_variants
+                {means_sql},
+                SUM(`afr_count`) as afr_count,
+                SUM(`row_count`) as total_records
+            FROM hse_variant_rollups
             WHERE {where_clause}
         """)
         
         result = db.session.execute(query, query_params_dict).fetchone()
         
-        # Query to calculate total score mean per station, then average across all stations
+        # score total: moyenne des moyennes par station precalculees
         total_score_query = text(f"""
-            SELECT AVG(station_mean) as total_score_mean
-            FROM (
-                SELECT 
-                    `station code`,
-                    (
-                        AVG(`ep01`) + AVG(`ep02`) + AVG(`ep03`) + AVG(`ep04`) + AVG(`ep05`) + 
-                        AVG(`ep06`) + AVG(`ep07`) + AVG(`ep08`) + AVG(`ep09`) + AVG(`ep10`) + AVG(`ep11`) +
-                        AVG(`es01`) + AVG(`es02`) + AVG(`es03`) + AVG(`es04`) + AVG(`es05`) + 
-                        AVG(`es06`) + AVG(`es07`) + AVG(`es08`) + AVG(`es09`) +
-                        AVG(`et01`) + AVG(`et02`) + AVG(`et03`) + AVG(`et04`) + AVG(`et05`)
-                    ) / 25 as station_mean
-                FROM hse_variants
-                WHERE {where_clause}
-                GROUP BY `station code`
-            ) as station_scores
+            SELECT AVG(`station_mean`) as total_score_mean
+            FROM hse_variant_rollups
+            WHERE {where_clause}
         """)
         
         total_score_result = db.session.execute(total_score_query, query_params_dict).fetchone()
@@ -362,7 +874,7 @@ def get_stats():
                 `dodo inspected`,
                 `stations inspected`
             FROM extractions
-            WHERE DATE(`date`) = :query_date 
+            WHERE `date` = :query_date 
             AND `zone` = 'All' 
             AND `sub-zone` = 'All'
             LIMIT 1
@@ -395,15 +907,15 @@ def get_stats():
                 
         # query to get the total records and afr records
         total_records_query = text("""
-            SELECT SUM(CASE WHEN `zone` = 'AFR' THEN 1 ELSE 0 END) as afr_count,
-                COUNT(*) as total_records from hse_variants WHERE DATE(`date`) = :query_date 
+            SELECT SUM(`afr_count`) as afr_count,
+                SUM(`row_count`) as total_records from hse_variant_rollups WHERE `date` = :query_date 
         """)
         
         total_records_result = db.session.execute(total_records_query, query_params_dict).fetchone()
-        total_afr_records = total_records_result[0] if total_records_result else 0
+        total_afr_records = total_records_result[0] if total_records_result and total_records_result[0] is not None else 0
         
-        if not result or result[-1] == 0:
-            return jsonify({
+        if not result or not result[-1]:
+            return {
                 "date": date_param,
                 "zone": zone_param,
                 "sub_zone": sub_zone_param,
@@ -413,7 +925,7 @@ def get_stats():
                 "message": "Aucune donnée trouvée pour ces filtres",
                 "data": None,
                 "management_modes": management_modes
-            }), 200
+            }, 200
 
         ep_data = {}
         es_data = {}
@@ -437,7 +949,7 @@ def get_stats():
             value = result[20 + i]
             et_data[et_num] = round(float(value), 2) if value is not None else 0
         
-        return jsonify({
+        return {
             "date": date_param,
             "zone": zone_param,
             "sub_zone": sub_zone_param,
@@ -451,56 +963,166 @@ def get_stats():
             "ep": ep_data,
             "es": es_data,
             "et": et_data
-        }), 200
+        }, 200
         
     except Exception as e:
-        return jsonify({
+        return {
             "error": f"Erreur lors de la récupération des statistiques: {str(e)}"
-        }), 500
-                
-# declancher l'extraction des fichier
+        }, 500
+
+# declancher l'extraction des fichier (en arriere-plan, suivi via /jobs/<id>)
 @app.route('/extract', methods=['GET'])
 def execute_test():
-    env = os.environ.copy()
-    env['PYTHONIOENCODING'] = 'utf-8'
-    
     try:
-        # Execute extraction.py en utilisant les subprocess
-        result = subprocess.run(
-            [sys.executable, 'scripts/extraction.py'],
-            capture_output=True,
-            text=True,
-            timeout=60,  # 1 minute -> 60s
-            env=env,
-            encoding='utf-8',
-            errors='replace'
-        )
-        
-        # verifier si extraction terminer
-        if result.returncode == 0:
-            return jsonify({
-                'status': 'success',
-                'message': 'done',
-                'output': result.stdout
-            }), 200
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': "Un problème est survenu lors de l’exécution du script",
-                'error': result.stderr
-            }), 500
-            
-    except subprocess.TimeoutExpired:
+        job_id = job_queue.enqueue('extract', user_id=request.args.get('user_id', type=int))
         return jsonify({
-            'status': 'error',
-            'message': "Une erreur s’est produite pendant l’extraction des données."
-        }), 500
+            'status': 'queued',
+            'message': "Extraction ajoutée à la file d'attente",
+            'job_id': job_id,
+            'status_url': f"/jobs/{job_id}"
+        }), 202
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f"Une erreur inattendue s'est produite: {str(e)}"
         }), 500
 
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    try:
+        jobs = job_queue.list(kind=request.args.get('kind'), limit=request.args.get('limit', 20, type=int))
+        return jsonify({"jobs": jobs}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = job_queue.get(job_id)
+        if not job:
+            return jsonify({"error": "Job introuvable"}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    try:
+        if not job_queue.get(job_id):
+            return jsonify({"error": "Job introuvable"}), 404
+        if not job_queue.cancel(job_id):
+            return jsonify({"error": "Le job est déjà terminé"}), 409
+        return jsonify({"message": "Annulation demandée", "job": job_queue.get(job_id)}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def run_parse_job(queue, job):
+    """ jobs 'parse': met en cache les feuilles analysees d'un depot, par hash du contenu """
+    payload = job['payload']
+    filepath = os.path.join(UPLOAD_FOLDER, secure_filename(payload['filename']))
+    if not os.path.exists(filepath):
+        return f"Fichier {payload['filename']} supprimé avant l'analyse"
+    return queue.run_subprocess(job, [
+        sys.executable, 'scripts/sheet_cache.py', 'parse', filepath, '--content-hash', payload['content_hash']
+    ])
+
+
+def run_extraction_job(queue, job):
+    """ jobs 'extract': lance extraction.py, qui rapporte ses etapes dans la table jobs """
+    try:
+        return queue.run_subprocess(job, [sys.executable, 'scripts/extraction.py'])
+    finally:
+        invalidate_stats_cache_after_extraction(job['started_at'])
+
+
+def run_delete_job(queue, job):
+    """ jobs 'delete': supprime les lignes d'un depot, puis son fichier, ses feuilles en cache et son enregistrement """
+    file_record = FileUploads.query.filter_by(id=job['payload']['file_id']).first()
+    if not file_record:
+        return "Fichier déjà supprimé"
+
+    # seuls les depots dont les lignes sont (ou vont etre) publiees comptent; 'pending' et 'failed' n'en ont aucune
+    other_uploads = FileUploads.query.filter(
+        FileUploads.date_created == file_record.date_created,
+        FileUploads.id != file_record.id,
+        FileUploads.file_status.in_(['completed', 'processing'])
+    ).all()
+    # un depot 'pending' ou 'failed' n'a rien publie (publication en une transaction); 'deleting' = suppression relancee
+    published_rows = job['payload'].get('previous_status', 'completed') not in ('pending', 'failed')
+    republished = []
+    if other_uploads or not published_rows:
+        def on_chunk(table_name, rows):
+            queue.update_progress(job['id'], stage=f"suppression des lignes de {table_name}", rows=rows)
+            if queue.is_cancel_requested(job['id']):
+                raise JobCancelled("Suppression interrompue; relancez-la pour supprimer les lignes restantes")
+
+        # seules les lignes de ce depot, en transactions courtes: les autres depots de la date gardent les leurs
+        deletion_counts = delete_file_rows(db, file_record.id, file_record.date_created, on_chunk=on_chunk)
+
+        # une ligne appartient au dernier depot extrait: les stations que ce depot partageait avec les autres
+        # depots termines de la date viennent de perdre leurs lignes, ces depots sont re-extraits pour les republier
+        deleted_rows = any(count for table_name, count in deletion_counts.items() if table_name != 'stations')
+        if published_rows or deleted_rows:
+            republished = [upload for upload in other_uploads if upload.file_status == 'completed']
+        if republished:
+            for upload in republished:
+                upload.file_status = 'pending'
+            db.session.commit()
+            queue.enqueue('extract', user_id=job['user_id'])
+    else:
+        # seul depot publie de sa date: supprimer les partitions de la date retire aussi ses lignes ingerees avant le lignage
+        queue.update_progress(job['id'], stage="suppression des partitions de la date")
+        deletion_counts = delete_data_by_date(db, file_record.date_created)
+    invalidate_stats_cache_for_dates([file_record.date_created])
+
+    filepath = os.path.join(UPLOAD_FOLDER, secure_filename(file_record.filename))
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    content_hash = file_record.content_hash
+    db.session.delete(file_record)
+    db.session.commit()
+    remove_sheet_cache(content_hash)
+    # limites d'age et de taille du cache appliquees meme quand aucun nouveau fichier n'est analyse
+    try:
+        queue.run_subprocess(job, [sys.executable, 'scripts/sheet_cache.py', 'evict'])
+    except RuntimeError as e:
+        print(f"Eviction du cache des feuilles impossible: {str(e)}")
+
+    output = ", ".join(f"{table_name}: {count}" for table_name, count in deletion_counts.items())
+    if republished:
+        output += f"\n{len(republished)} autre(s) dépôt(s) du {file_record.date_created} remis en attente d'extraction"
+    return output
+
+
+def invalidate_stats_cache_after_extraction(started_at):
+    """ retire du cache les statistiques des dates dont cette extraction a termine les fichiers """
+    try:
+        completed_dates = db.session.execute(
+            text("SELECT DISTINCT date_created FROM file_uploads WHERE file_status = 'completed' AND updated_at >= :started_at"),
+            {"started_at": started_at}
+        ).fetchall()
+        invalidate_stats_cache_for_dates([row[0] for row in completed_dates], invariants_changed=True)
+    except Exception as e:
+        print(f"Erreur lors de l'invalidation du cache des statistiques: {str(e)}")
+
+job_queue = JobQueue(app, db)
+job_queue.register('extract', run_extraction_job)
+job_queue.register('parse', run_parse_job)
+job_queue.register('delete', run_delete_job)
+
+def start_job_worker(use_reloader):
+    # le processus parent du reloader de Werkzeug ne sert aucune requete: le worker demarre dans le processus enfant
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
+
 if __name__ == '__main__':
+    start_job_worker(use_reloader=True)
     app.run(debug=True)
+else:
+    # `flask run --debug` charge aussi l'application dans le processus parent du reloader
+    start_job_worker(use_reloader=get_debug_flag())
 
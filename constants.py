@@ -55,5 +55,19 @@ SUB_ZONES = {
     ]
 }
 
+# EP/ES/ET score columns averaged by the dashboard (same order as the hse_variant_rollups columns)
+HSE_SCORE_COLUMNS = (
+    [f"ep{i:02d}" for i in range(1, 12)]
+    + [f"es{i:02d}" for i in range(1, 10)]
+    + [f"et{i:02d}" for i in range(1, 6)]
+)
+
 def get_countries_by_subzone(sub_zone: str) -> list[str]:
-    return SUB_ZONES.get(sub_zone, [])
\ No newline at end of file
+    return SUB_ZONES.get(sub_zone, [])
+
+# sheets and header columns an ERIS report must have to be extracted (checked by validation.py on upload)
+REPORT_SHEET_SCHEMA = {
+    "Inspections": ["affiliate", "inspector"],
+    "Questions": ["affiliate", "station code", "d.02"],
+    "HSE Invariants": ["affiliate", "station code"],
+}
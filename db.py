@@ -1,4 +1,5 @@
 import os
+import threading
 from dotenv import load_dotenv
 from sqlalchemy import text
 import pandas as pd
@@ -11,6 +12,11 @@ DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
 DB_PORT = os.getenv("DB_PORT", 3306)
 
+# fact tables filled by scripts/extraction.py, whose rows carry the id of the upload they came from
+FACT_TABLES = ("hse_variants", "extractions", "extraction_questions", "hse_variant_rollups")
+# rows removed per DELETE (and per transaction) when an upload sharing its date with others is deleted
+DELETE_CHUNK_ROWS = int(os.getenv("DELETE_CHUNK_ROWS", 5000))
+
 def get_db_uri():
     return f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
@@ -25,6 +31,39 @@ def get_db_config():
     return DB_CONFIG
 
 
+def table_exists(db, table_name):
+    result = db.session.execute(
+        text("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table_name"),
+        {"table_name": table_name}
+    ).fetchone()
+    return bool(result and result[0])
+
+
+def get_date_partition_name(date_str):
+    """ same partition naming as scripts/helper.py """
+    return "p" + date_str[:10].replace("-", "")
+
+def delete_date_rows(db, table_name, date_str):
+    """ drop the date's partition of a date-partitioned fact table, or delete its rows; returns the row count """
+    partition_name = get_date_partition_name(date_str)
+    has_partition = db.session.execute(
+        text("""
+            SELECT COUNT(*) FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = :table_name AND partition_name = :partition_name
+        """),
+        {"table_name": table_name, "partition_name": partition_name}
+    ).scalar()
+    if has_partition:
+        row_count = db.session.execute(text(f"SELECT COUNT(*) FROM `{table_name}` PARTITION (`{partition_name}`)")).scalar()
+        db.session.execute(text(f"ALTER TABLE `{table_name}` DROP PARTITION `{partition_name}`"))
+        return row_count
+
+    result = db.session.execute(
+        text(f"DELETE FROM `{table_name}` WHERE `date` = :date_to_delete"),
+        {"date_to_delete": date_str}
+    )
+    return result.rowcount
+
 def delete_data_by_date(db, date_to_delete):
     try:
         if hasattr(date_to_delete, 'strftime'):
@@ -34,26 +73,23 @@ def delete_data_by_date(db, date_to_delete):
         
         deletion_counts = {}
         
-        hse_delete_query = text("""
-            DELETE FROM hse_variants 
-            WHERE DATE(`date`) = :date_to_delete
-        """)
-        hse_result = db.session.execute(hse_delete_query, {"date_to_delete": date_str})
-        deletion_counts['hse_variants'] = hse_result.rowcount
+        # partition drops are DDL (implicit commit): run them before the row deletes below
+        for table_name in ("hse_variants", "extractions", "extraction_questions"):
+            deletion_counts[table_name] = delete_date_rows(db, table_name, date_str)
+        
+        # keep the dashboard rollup consistent with hse_variants
+        if table_exists(db, "hse_variant_rollups"):
+            deletion_counts['hse_variant_rollups'] = delete_date_rows(db, "hse_variant_rollups", date_str)
         
-        extractions_delete_query = text("""
-            DELETE FROM extractions 
-            WHERE DATE(`date`) = :date_to_delete
-        """)
-        extractions_result = db.session.execute(extractions_delete_query, {"date_to_delete": date_str})
-        deletion_counts['extractions'] = extractions_result.rowcount
+        if table_exists(db, "report_dates"):
+            dates_result = db.session.execute(
+                text("DELETE FROM report_dates WHERE `date` = :date_to_delete"),
+                {"date_to_delete": date_str}
+            )
+            deletion_counts['report_dates'] = dates_result.rowcount
         
-        questions_delete_query = text("""
-            DELETE FROM extraction_questions 
-            WHERE DATE(`date`) = :date_to_delete
-        """)
-        questions_result = db.session.execute(questions_delete_query, {"date_to_delete": date_str})
-        deletion_counts['extraction_questions'] = questions_result.rowcount
+        if table_exists(db, "stations") and table_exists(db, "hse_variant_rollups"):
+            deletion_counts['stations'] = refresh_stations_after_date_delete(db, date_str)
         
         db.session.commit()
         
@@ -61,9 +97,102 @@ def delete_data_by_date(db, date_to_delete):
         
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Error deleting data of date {date_str} from extractions, hse_variants and extraction_questions: {str(e)}")
+        print(f"❌ Error deleting data of date {date_str} from extractions, hse_variants, extraction_questions and hse_variant_rollups: {str(e)}")
         raise e
 
+def refresh_stations_after_date_delete(db, date_str):
+    """ recompute first/last seen of the stations seen on the deleted date, drop those left in no report """
+    affected_codes = [row[0] for row in db.session.execute(
+        text("SELECT `station code` FROM stations WHERE `first_seen` = :date_to_delete OR `last_seen` = :date_to_delete"),
+        {"date_to_delete": date_str}
+    ).fetchall()]
+    if not affected_codes:
+        return 0
+
+    placeholders = ','.join([f':code_{i}' for i in range(len(affected_codes))])
+    params = {f'code_{i}': code for i, code in enumerate(affected_codes)}
+    db.session.execute(text(f"""
+        UPDATE stations s
+        JOIN (
+            SELECT `station code`, MIN(`date`) as first_seen, MAX(`date`) as last_seen
+            FROM hse_variant_rollups
+            WHERE `station code` IN ({placeholders})
+            GROUP BY `station code`
+        ) r ON r.`station code` = s.`station code`
+        SET s.`first_seen` = r.first_seen, s.`last_seen` = r.last_seen
+    """), params)
+
+    # other uploads of the same date may still report some of these stations
+    stations_result = db.session.execute(text(f"""
+        DELETE FROM stations
+        WHERE `station code` IN ({placeholders})
+          AND `station code` NOT IN (
+              SELECT `station code` FROM hse_variant_rollups WHERE `station code` IN ({placeholders})
+          )
+    """), params)
+
+    return stations_result.rowcount
+
+def refresh_report_date(db, date_str):
+    """ recount the date in report_dates from the rollup; the date disappears once it has no rows """
+    db.session.execute(text("DELETE FROM report_dates WHERE `date` = :report_date"), {"report_date": date_str})
+    db.session.execute(text("""
+        INSERT INTO report_dates (`date`, `station_count`, `row_count`, `updated_at`)
+        SELECT `date`, COUNT(*), SUM(`row_count`), NOW()
+        FROM hse_variant_rollups
+        WHERE `date` = :report_date
+        GROUP BY `date`
+    """), {"report_date": date_str})
+
+def has_column(db, table_name, column_name):
+    result = db.session.execute(
+        text("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = :table_name AND column_name = :column_name
+        """),
+        {"table_name": table_name, "column_name": column_name}
+    ).fetchone()
+    return bool(result and result[0])
+
+def delete_file_rows(db, file_upload_id, date_to_delete, chunk_rows=None, on_chunk=None):
+    """ delete the rows ingested from one upload in chunks of chunk_rows, one short transaction each,
+        then refresh the dimensions of its date; on_chunk(table_name, rows) is called after each chunk.
+        Rows belong to the last upload extracted for their key, so rows this upload took over from earlier
+        uploads of the date are deleted too: the caller re-extracts those uploads to republish them """
+    chunk_rows = chunk_rows or DELETE_CHUNK_ROWS
+    date_str = date_to_delete.strftime('%Y-%m-%d') if hasattr(date_to_delete, 'strftime') else str(date_to_delete)
+
+    deletion_counts = {}
+    for table_name in FACT_TABLES:
+        if not table_exists(db, table_name) or not has_column(db, table_name, "file_upload_id"):
+            continue
+        deleted = 0
+        while True:
+            result = db.session.execute(
+                text(f"DELETE FROM `{table_name}` WHERE `file_upload_id` = :file_upload_id LIMIT :chunk_rows"),
+                {"file_upload_id": file_upload_id, "chunk_rows": chunk_rows}
+            )
+            db.session.commit()
+            deleted += result.rowcount
+            if on_chunk:
+                on_chunk(table_name, result.rowcount)
+            if result.rowcount < chunk_rows:
+                break
+        deletion_counts[table_name] = deleted
+
+    try:
+        if table_exists(db, "report_dates") and table_exists(db, "hse_variant_rollups"):
+            refresh_report_date(db, date_str)
+        if table_exists(db, "stations") and table_exists(db, "hse_variant_rollups"):
+            deletion_counts['stations'] = refresh_stations_after_date_delete(db, date_str)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return deletion_counts
+
+
 def get_filepath(filename="Invariants.xlsx"):
     backend_dir = os.path.dirname(os.path.abspath(__file__))
     input_dir = os.path.join(backend_dir, "input")
@@ -74,147 +203,128 @@ def get_filepath(filename="Invariants.xlsx"):
 
     return file_path
 
-def get_lists_of_cost_centers_by_management_mode(db, management_mode):
+# Parsed Invariants sheet shared by every request, reloaded when the file changes on disk
+# (mtime/size), e.g. after extraction.py writes the matched cost centers back.
+_invariants_cache = {"signature": None, "df": None, "cost_center_col": None, "indexes": {}}
+_invariants_cache_lock = threading.Lock()
+INVARIANTS_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# dashboard filter -> keywords identifying its column in the Invariants sheet;
+# any other Invariants column can also be used by its (stripped) header
+INVARIANTS_ATTRIBUTE_COLUMNS = {
+    "management_mode": ["management method", "management mode"],
+    "segmentation": ["segmentation"],
+    "affiliate": ["affiliate"]
+}
+
+
+def find_invariants_column(columns, keywords):
+    # last matching column wins, as in the original column scan
+    found = None
+    for col in columns:
+        col_lower = col.lower()
+        if any(keyword in col_lower for keyword in keywords):
+            found = col
+    return found
+
+
+def build_cost_center_index(df, cost_center_col, attribute_col):
+    """ attribute value (lowercase) -> cost centers in sheet order, deduplicated case-insensitively """
+    pairs = pd.DataFrame({"value": df[attribute_col], "cost_center": df[cost_center_col]}).dropna()
+    pairs["value"] = pairs["value"].astype(str).str.lower().str.strip()
+    pairs["cost_center"] = pairs["cost_center"].astype(str).str.strip()
+    pairs["cost_center_key"] = pairs["cost_center"].str.lower()
+    pairs = pairs.drop_duplicates(subset=["value", "cost_center_key"])
+    return {value: group.tolist() for value, group in pairs.groupby("value", sort=False)["cost_center"]}
+
+
+def load_invariants_sheet():
+    """ parsed Invariants sheet, from the cache unless the file changed; call with the lock held """
+    invariants_path = get_filepath("Invariants.xlsx")
+    stat_info = os.stat(invariants_path)
+    signature = (stat_info.st_mtime_ns, stat_info.st_size)
+
+    if _invariants_cache["signature"] == signature:
+        INVARIANTS_CACHE_STATS["hits"] += 1
+        return _invariants_cache
+
+    INVARIANTS_CACHE_STATS["misses"] += 1
+    df = pd.read_excel(invariants_path, header=4)
+    df.columns = df.columns.astype(str).str.strip()
+    cost_center_col = find_invariants_column(df.columns, ["cost center", "cost centre"])
+
+    _invariants_cache.update({"signature": signature, "df": df, "cost_center_col": cost_center_col, "indexes": {}})
+    # the dashboard filters are indexed up front, other columns on first use
+    for attribute in INVARIANTS_ATTRIBUTE_COLUMNS:
+        get_cost_center_index_locked(attribute)
+    return _invariants_cache
+
+
+def get_cost_center_index_locked(attribute):
+    indexes = _invariants_cache["indexes"]
+    if attribute in indexes:
+        return indexes[attribute]
+
+    df = _invariants_cache["df"]
+    cost_center_col = _invariants_cache["cost_center_col"]
+    keywords = INVARIANTS_ATTRIBUTE_COLUMNS.get(attribute)
+    if keywords:
+        attribute_col = find_invariants_column([col for col in df.columns if col != cost_center_col], keywords)
+    else:
+        attribute_col = attribute if attribute in df.columns else None
+
+    if not cost_center_col or not attribute_col:
+        print(f"Warning: Required columns not found!")
+        print(f"Cost Center: {cost_center_col}, {attribute}: {attribute_col}")
+        indexes[attribute] = None
+    else:
+        indexes[attribute] = build_cost_center_index(df, cost_center_col, attribute_col)
+    return indexes[attribute]
+
+
+def get_cost_center_index(attribute):
+    with _invariants_cache_lock:
+        load_invariants_sheet()
+        return get_cost_center_index_locked(attribute)
+
+
+def get_invariants_cache_stats():
+    with _invariants_cache_lock:
+        total = INVARIANTS_CACHE_STATS["hits"] + INVARIANTS_CACHE_STATS["misses"]
+        return {
+            "hits": INVARIANTS_CACHE_STATS["hits"],
+            "misses": INVARIANTS_CACHE_STATS["misses"],
+            "hit_rate": round(INVARIANTS_CACHE_STATS["hits"] / total, 4) if total else 0,
+            "loaded": _invariants_cache["signature"] is not None,
+            "indexed_attributes": sorted(_invariants_cache["indexes"])
+        }
+
+
+def get_lists_of_cost_centers(db, attribute, value):
+    """ cost centers whose Invariants `attribute` equals `value` and that have HSE data """
     try:
-        # Fetch distinct station codes from hse_variants table
-        station_codes_query = text("""
-            SELECT DISTINCT `station code` FROM hse_variants
-            WHERE `station code` IS NOT NULL
-        """)
+        # Station codes with HSE data, from the stations dimension when it exists
+        if table_exists(db, "stations"):
+            station_codes_query = text("SELECT `station code` FROM stations")
+        else:
+            station_codes_query = text("""
+                SELECT DISTINCT `station code` FROM hse_variants
+                WHERE `station code` IS NOT NULL
+            """)
         station_codes_result = db.session.execute(station_codes_query).fetchall()
-        cost_centers_list = [row[0] for row in station_codes_result]
+        cost_centers_lower = {str(row[0]).lower().strip() for row in station_codes_result}
 
-        if not cost_centers_list:
-            print("⚠️ No station codes found in hse_variants table")
+        if not cost_centers_lower:
+            print("⚠️ No station codes found in stations/hse_variants tables")
             return []
 
-        invariants_path = get_filepath("Invariants.xlsx")
-        df = pd.read_excel(invariants_path, header=4)
-
-        df.columns = df.columns.str.strip()
-
-        # Find the relevant columns (case-insensitive search)
-        cost_center_col = None
-        management_method_col = None
-
-        for col in df.columns:
-            col_lower = col.lower()
-            if "cost center" in col_lower or "cost centre" in col_lower:
-                cost_center_col = col
-            elif "management method" in col_lower or "management mode" in col_lower:
-                management_method_col = col
-
-        # Check if required columns were found
-        if not cost_center_col or not management_method_col:
-            print(f"Warning: Required columns not found!")
-            print(f"Cost Center: {cost_center_col}, Management Method: {management_method_col}")
+        index = get_cost_center_index(attribute)
+        if index is None:
             return []
 
-        mode_lower = str(management_mode).lower().strip()
-
-        cost_centers_lower = [str(cc).lower().strip() for cc in cost_centers_list]
-
-        matching_cost_centers = []
-
-        for _, row in df.iterrows():
-            cost_center = row[cost_center_col]
-            management_method = row[management_method_col]
-
-            if pd.isna(cost_center) or pd.isna(management_method):
-                continue
-
-            if str(management_method).lower().strip() == mode_lower:
-                cost_center_trimmed = str(cost_center).strip()
-                if cost_center_trimmed.lower() in cost_centers_lower:
-                    matching_cost_centers.append(cost_center_trimmed)
-
-        # Remove duplicates while preserving order
-        seen = set()
-        result = []
-        for cc in matching_cost_centers:
-            cc_lower = cc.lower()
-            if cc_lower not in seen:
-                seen.add(cc_lower)
-                result.append(cc)
-
-        return result
+        value_lower = str(value).lower().strip()
+        return [cc for cc in index.get(value_lower, []) if cc.lower() in cost_centers_lower]
 
     except Exception as e:
-        print(f"❌ Error in get_lists_of_cost_centers_by_management_mode: {str(e)}")
+        print(f"❌ Error in get_lists_of_cost_centers ({attribute}): {str(e)}")
         return []
-
-
-def get_lists_of_cost_centers_by_segmentation(db, segmentation):
-    try:
-        # Fetch distinct station codes from hse_variants table
-        station_codes_query = text("""
-            SELECT DISTINCT `station code` FROM hse_variants
-            WHERE `station code` IS NOT NULL
-        """)
-        station_codes_result = db.session.execute(station_codes_query).fetchall()
-        cost_centers_list = [row[0] for row in station_codes_result]
-
-        if not cost_centers_list:
-            print("⚠️ No station codes found in hse_variants table")
-            return []
-
-        # Read the Excel file
-        invariants_path = get_filepath("Invariants.xlsx")
-        df = pd.read_excel(invariants_path, header=4)
-
-        df.columns = df.columns.str.strip()
-
-        # Find the relevant columns (case-insensitive search)
-        cost_center_col = None
-        segmentation_col = None
-
-        for col in df.columns:
-            col_lower = col.lower()
-            if "cost center" in col_lower or "cost centre" in col_lower:
-                cost_center_col = col
-            elif "segmentation" in col_lower:
-                segmentation_col = col
-
-        # Check if required columns were found
-        if not cost_center_col or not segmentation_col:
-            print(f"Warning: Required columns not found!")
-            print(f"Cost Center: {cost_center_col}, Segmentation: {segmentation_col}")
-            return []
-
-        # Normalize the segmentation to lowercase for comparison
-        seg_lower = str(segmentation).lower().strip()
-
-        # Convert input cost centers to lowercase for comparison
-        cost_centers_lower = [str(cc).lower().strip() for cc in cost_centers_list]
-
-        # Filter data based on segmentation and cost centers
-        matching_cost_centers = []
-
-        for _, row in df.iterrows():
-            cost_center = row[cost_center_col]
-            segmentation_value = row[segmentation_col]
-
-            # Skip rows with missing values
-            if pd.isna(cost_center) or pd.isna(segmentation_value):
-                continue
-
-            # Check if segmentation matches and cost center is in the list
-            if str(segmentation_value).lower().strip() == seg_lower:
-                cost_center_trimmed = str(cost_center).strip()
-                if cost_center_trimmed.lower() in cost_centers_lower:
-                    matching_cost_centers.append(cost_center_trimmed)
-
-        # Remove duplicates while preserving order
-        seen = set()
-        result = []
-        for cc in matching_cost_centers:
-            cc_lower = cc.lower()
-            if cc_lower not in seen:
-                seen.add(cc_lower)
-                result.append(cc)
-
-        return result
-
-    except Exception as e:
-        print(f"❌ Error in get_lists_of_cost_centers_by_segmentation: {str(e)}")
-        return []
\ No newline at end of file
@@ -22,16 +22,97 @@ def init_db(app, db, bcrypt):
             file_size VARCHAR(50) NOT NULL,
             file_status VARCHAR(100) NOT NULL DEFAULT 'pending',
             date_created DATE NOT NULL,
+            content_hash CHAR(64),
             upload_date DATETIME DEFAULT CURRENT_TIMESTAMP,
             updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
             INDEX idx_user_id (user_id),
-            INDEX idx_upload_date (upload_date)
+            INDEX idx_upload_date (upload_date),
+            INDEX idx_file_status_upload_date (file_status, upload_date),
+            INDEX idx_content_hash_date_created (content_hash, date_created)
+        );
+        """
+
+        # depots par morceaux en cours (POST /upload-sessions puis PUT /upload-sessions/<id>), ecrits dans UPLOAD_PARTS_FOLDER
+        create_upload_sessions_table = """
+        CREATE TABLE IF NOT EXISTS upload_sessions(
+            id VARCHAR(32) PRIMARY KEY,
+            user_id INT NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            filetype VARCHAR(100) NOT NULL,
+            date_created DATE,
+            expected_size BIGINT,
+            received_bytes BIGINT NOT NULL DEFAULT 0,
+            status VARCHAR(20) NOT NULL DEFAULT 'open',
+            file_upload_id INT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_upload_sessions_status (status, updated_at)
+        );
+        """
+
+        # jobs en arriere-plan (extractions...), scrutes par le worker de jobs.py
+        create_jobs_table = """
+        CREATE TABLE IF NOT EXISTS jobs(
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            stage VARCHAR(255),
+            rows_processed INT NOT NULL DEFAULT 0,
+            payload TEXT,
+            output MEDIUMTEXT,
+            error MEDIUMTEXT,
+            cancel_requested TINYINT(1) NOT NULL DEFAULT 0,
+            user_id INT,
+            worker_id VARCHAR(255),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            heartbeat_at DATETIME,
+            finished_at DATETIME,
+            INDEX idx_jobs_status (status, id)
+        );
+        """
+
+        # invalidations du cache des statistiques, relues par chaque processus de l'application
+        create_stats_cache_invalidations_table = """
+        CREATE TABLE IF NOT EXISTS stats_cache_invalidations(
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            dates TEXT NOT NULL,
+            invariants_changed TINYINT(1) NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_stats_cache_invalidations_created_at (created_at)
         );
         """
 
         # Wrap SQL in text()
         db.session.execute(text(create_users_table))
         db.session.execute(text(create_file_uploads_table))
+        db.session.execute(text(create_jobs_table))
+        db.session.execute(text(create_upload_sessions_table))
+        db.session.execute(text(create_stats_cache_invalidations_table))
+
+        # index du claim des fichiers en attente (scripts/extraction.py) sur les tables existantes
+        has_status_index = db.session.execute(text("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'file_uploads' AND index_name = 'idx_file_status_upload_date'
+        """)).scalar()
+        if not has_status_index:
+            db.session.execute(text("ALTER TABLE file_uploads ADD INDEX idx_file_status_upload_date (file_status, upload_date)"))
+
+        # hash SHA-256 du contenu: cle du cache des feuilles analysees
+        has_content_hash = db.session.execute(text("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'file_uploads' AND column_name = 'content_hash'
+        """)).scalar()
+        if not has_content_hash:
+            db.session.execute(text("ALTER TABLE file_uploads ADD COLUMN content_hash CHAR(64) AFTER date_created"))
+
+        # detection des depots identiques (meme contenu, meme date de rapport) a la fin du depot
+        has_content_hash_index = db.session.execute(text("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'file_uploads' AND index_name = 'idx_content_hash_date_created'
+        """)).scalar()
+        if not has_content_hash_index:
+            db.session.execute(text("ALTER TABLE file_uploads ADD INDEX idx_content_hash_date_created (content_hash, date_created)"))
         db.session.commit()
 
         # Check and insert admin user
@@ -0,0 +1,211 @@
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from sqlalchemy import text
+
+# intervalle de scrutation de la file et de la battue de coeur des jobs en cours
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+# un job 'running' sans battue de coeur depuis ce delai est relance (app redemarree)
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 120))
+# delai laisse a un sous-processus annule pour liberer ses fichiers (SIGTERM) avant d'etre tue
+JOB_TERMINATE_TIMEOUT_SECONDS = int(os.getenv("JOB_TERMINATE_TIMEOUT_SECONDS", 30))
+JOB_LOG_FOLDER = os.path.join(os.getcwd(), 'logs', 'jobs')
+# taille de la fin du journal conservee dans la table jobs
+JOB_OUTPUT_TAIL_BYTES = 64 * 1024
+
+JOB_COLUMNS = """
+    id, kind, status, stage, rows_processed, payload, output, error, cancel_requested, user_id,
+    created_at, started_at, finished_at,
+    TIMESTAMPDIFF(SECOND, started_at, COALESCE(finished_at, NOW())) AS elapsed_seconds
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    """ File de jobs persistee dans la table `jobs`, executee par un thread de l'application """
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.handlers = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._thread = None
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._work_loop, name="job-worker", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, kind, payload=None, user_id=None):
+        result = self.db.session.execute(
+            text("INSERT INTO jobs (kind, payload, user_id) VALUES (:kind, :payload, :user_id)"),
+            {"kind": kind, "payload": json.dumps(payload) if payload is not None else None, "user_id": user_id}
+        )
+        self.db.session.commit()
+        return result.lastrowid
+
+    def get(self, job_id):
+        row = self.db.session.execute(
+            text(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = :job_id"), {"job_id": job_id}
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, kind=None, limit=20):
+        where_clause = "WHERE kind = :kind" if kind else ""
+        rows = self.db.session.execute(
+            text(f"SELECT {JOB_COLUMNS} FROM jobs {where_clause} ORDER BY id DESC LIMIT :limit"),
+            {"kind": kind, "limit": limit}
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def cancel(self, job_id):
+        """ annule un job en attente, ou demande l'arret d'un job en cours """
+        queued = self.db.session.execute(
+            text("UPDATE jobs SET status = 'cancelled', finished_at = NOW() WHERE id = :job_id AND status = 'queued'"),
+            {"job_id": job_id}
+        )
+        running = self.db.session.execute(
+            text("UPDATE jobs SET cancel_requested = 1 WHERE id = :job_id AND status = 'running'"),
+            {"job_id": job_id}
+        )
+        self.db.session.commit()
+        return queued.rowcount > 0 or running.rowcount > 0
+
+    def update_progress(self, job_id, stage=None, rows=0):
+        self.db.session.execute(
+            text("""
+                UPDATE jobs SET stage = COALESCE(:stage, stage), rows_processed = rows_processed + :rows, heartbeat_at = NOW()
+                WHERE id = :job_id
+            """),
+            {"job_id": job_id, "stage": stage, "rows": rows}
+        )
+        self.db.session.commit()
+
+    def is_cancel_requested(self, job_id):
+        row = self.db.session.execute(
+            text("SELECT cancel_requested FROM jobs WHERE id = :job_id"), {"job_id": job_id}
+        ).fetchone()
+        return bool(row and row[0])
+
+    def run_subprocess(self, job, args):
+        """ execute un script en sous-processus, sans limite de temps, annulable via la table jobs """
+        os.makedirs(JOB_LOG_FOLDER, exist_ok=True)
+        log_path = os.path.join(JOB_LOG_FOLDER, f"{job['id']}.log")
+        env = os.environ.copy()
+        env['PYTHONIOENCODING'] = 'utf-8'
+        env['JOB_ID'] = str(job['id'])
+
+        with open(log_path, 'w', encoding='utf-8', errors='replace') as log_file:
+            process = subprocess.Popen(args, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+            while True:
+                try:
+                    returncode = process.wait(timeout=JOB_POLL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    self.update_progress(job['id'])
+                    if self.is_cancel_requested(job['id']):
+                        process.terminate()
+                        try:
+                            process.wait(timeout=JOB_TERMINATE_TIMEOUT_SECONDS)
+                        except subprocess.TimeoutExpired:
+                            process.kill()
+                        raise JobCancelled("Job annulé à la demande de l'utilisateur")
+
+        output = self._read_log_tail(log_path)
+        if returncode != 0:
+            raise RuntimeError(f"Le script s'est terminé avec le code {returncode}\n{output}")
+        return output
+
+    def _work_loop(self):
+        while True:
+            job = None
+            try:
+                with self.app.app_context():
+                    self._requeue_stale_jobs()
+                    job = self._claim_next_job()
+                    if job:
+                        self._run_job(job)
+            except Exception as e:
+                print(f"Erreur du worker de jobs: {str(e)}")
+            if not job:
+                time.sleep(JOB_POLL_SECONDS)
+
+    def _requeue_stale_jobs(self):
+        result = self.db.session.execute(
+            text("""
+                UPDATE jobs SET status = 'queued', worker_id = NULL, stage = 'relancé après interruption'
+                WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - INTERVAL :stale SECOND)
+            """),
+            {"stale": JOB_STALE_SECONDS}
+        )
+        self.db.session.commit()
+        if result.rowcount:
+            print(f"{result.rowcount} job(s) interrompu(s) remis en file d'attente")
+
+    def _claim_next_job(self):
+        row = self.db.session.execute(
+            text("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1")
+        ).fetchone()
+        if not row:
+            return None
+
+        # un autre worker a pu reclamer le meme job entre-temps
+        claimed = self.db.session.execute(
+            text("""
+                UPDATE jobs SET status = 'running', stage = 'démarrage', worker_id = :worker_id,
+                    started_at = NOW(), heartbeat_at = NOW(), finished_at = NULL
+                WHERE id = :job_id AND status = 'queued'
+            """),
+            {"job_id": row[0], "worker_id": self.worker_id}
+        )
+        self.db.session.commit()
+        return self.get(row[0]) if claimed.rowcount == 1 else None
+
+    def _run_job(self, job):
+        handler = self.handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise ValueError(f"Type de job inconnu: {job['kind']}")
+            output = handler(self, job)
+            self._finish(job['id'], 'completed', output=output)
+        except JobCancelled as e:
+            self._finish(job['id'], 'cancelled', output=str(e))
+        except Exception as e:
+            self.db.session.rollback()
+            self._finish(job['id'], 'failed', error=str(e))
+
+    def _finish(self, job_id, status, output=None, error=None):
+        stage = {'completed': 'terminé', 'cancelled': 'annulé', 'failed': 'échec'}[status]
+        self.db.session.execute(
+            text("""
+                UPDATE jobs SET status = :status, stage = :stage, output = :output, error = :error, finished_at = NOW()
+                WHERE id = :job_id
+            """),
+            {"job_id": job_id, "status": status, "stage": stage, "output": output, "error": error}
+        )
+        self.db.session.commit()
+
+    def _read_log_tail(self, log_path):
+        with open(log_path, 'rb') as log_file:
+            log_file.seek(0, os.SEEK_END)
+            log_file.seek(max(0, log_file.tell() - JOB_OUTPUT_TAIL_BYTES))
+            return log_file.read().decode('utf-8', errors='replace')
+
+    def _to_dict(self, row):
+        job = dict(row._mapping)
+        job['payload'] = json.loads(job['payload']) if job.get('payload') else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if job.get(key):
+                job[key] = job[key].strftime('%Y-%m-%d %H:%M:%S')
+        return job
@@ -0,0 +1,72 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from sheets import REPORT_SHEETS, HAS_CALAMINE, clean_dataframe, load_sheets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATTERN = os.path.join(BACKEND_DIR, "uploads", "ERIS_Report_Extraction_*.xlsx")
+
+def load_sheets_with_threads(file_path):
+    """ ancienne lecture: pd.read_excel (openpyxl) dans un pool de 3 threads """
+    xls = pd.ExcelFile(file_path)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        frames = executor.map(lambda name: pd.read_excel(xls, sheet_name=name), REPORT_SHEETS)
+        return {name: clean_dataframe(df) for name, df in zip(REPORT_SHEETS, frames)}
+
+def get_benchmark_cases(workers):
+    cases = [
+        ("openpyxl / threads (ancien)", load_sheets_with_threads),
+        ("openpyxl / processus", lambda path: load_sheets(path, engine="openpyxl", workers=workers, process_min_bytes=0)),
+    ]
+    if HAS_CALAMINE:
+        cases += [
+            ("calamine / sequentiel", lambda path: load_sheets(path, engine="calamine", workers=1)),
+            ("calamine / processus", lambda path: load_sheets(path, engine="calamine", workers=workers, process_min_bytes=0)),
+        ]
+    cases.append(("configuration actuelle", load_sheets))
+    return cases
+
+def same_sheets(expected, actual):
+    for name in REPORT_SHEETS:
+        left, right = expected[name], actual[name]
+        if list(left.columns) != list(right.columns) or left.shape != right.shape:
+            return False
+        for col in left.columns:
+            if not ((left[col] == right[col]) | (left[col].isna() & right[col].isna())).all():
+                return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare les moteurs de lecture des feuilles des rapports ERIS")
+    parser.add_argument("files", nargs="*", help=f"classeurs a lire (defaut: {DEFAULT_PATTERN})")
+    parser.add_argument("--repeat", type=int, default=3, help="meilleur temps sur N lectures")
+    parser.add_argument("--workers", type=int, default=len(REPORT_SHEETS), help="processus pour les cas 'processus'")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(DEFAULT_PATTERN))
+    if not files:
+        print(f"Aucun fichier a comparer ({DEFAULT_PATTERN})")
+        return
+    if not HAS_CALAMINE:
+        print("python-calamine non installe: seuls les cas openpyxl sont mesures")
+    print(f"cpu: {os.cpu_count()}, repetitions: {args.repeat}")
+
+    for file_path in files:
+        print(f"\n{os.path.basename(file_path)} ({os.path.getsize(file_path) / (1024 * 1024):.1f} MB)")
+        reference = None
+        for label, load in get_benchmark_cases(args.workers):
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                sheets = load(file_path)
+                timings.append(time.perf_counter() - start)
+            if reference is None:
+                reference = sheets
+            status = "identique" if same_sheets(reference, sheets) else "DIFFERENT"
+            print(f"  {label:<30} {min(timings):7.2f}s  {status}")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+import re
 from difflib import get_close_matches
+from functools import lru_cache
 import unidecode
 
 countries_map = {
@@ -44,9 +46,28 @@ countries_map = {
     "central african republic": "CE",
 }
 
+def normalize_key(name):
+    return unidecode.unidecode(name.lower())
+
+def build_country_resolver():
+    """ une seule regex pour toutes les cles normalisees; la premiere cle du dictionnaire l'emporte """
+    normalized_countries = {}
+    for country_name in countries_map.keys():
+        # deux cles de meme forme normalisee ("senegal"/"sénégal"): la premiere est retenue
+        normalized_countries.setdefault(normalize_key(country_name), country_name)
+
+    priorities = {normalized: index for index, normalized in enumerate(normalized_countries)}
+    # lookahead: toutes les positions de depart sont testees, y compris les correspondances chevauchantes;
+    # a une position donnee l'alternative de plus petite priorite est essayee en premier
+    alternation = "|".join(re.escape(normalized) for normalized in normalized_countries)
+    return re.compile(f"(?=({alternation}))"), normalized_countries, priorities
+
+COUNTRY_PATTERN, NORMALIZED_COUNTRIES, COUNTRY_PRIORITIES = build_country_resolver()
+
 def get_country_map():
     return countries_map
 
+@lru_cache(maxsize=4096)
 def normalize_country(affiliate_name):
     if not isinstance(affiliate_name, str):
         return None
@@ -67,12 +88,17 @@ def get_country_code(country_name):
     code = countries_map.get(country_name.lower())
     return code
 
+@lru_cache(maxsize=4096)
 def extract_country(affiliate_name):
     if not isinstance(affiliate_name, str):
         return None
-    affiliate_clean = unidecode.unidecode(affiliate_name.lower())
-    for country_name in countries_map.keys():
-        country_clean = unidecode.unidecode(country_name.lower())
-        if country_clean in affiliate_clean:
-            return country_name.title()
-    return None
\ No newline at end of file
+    matches = [match.group(1) for match in COUNTRY_PATTERN.finditer(normalize_key(affiliate_name))]
+    if not matches:
+        return None
+    best_match = min(matches, key=COUNTRY_PRIORITIES.__getitem__)
+    return NORMALIZED_COUNTRIES[best_match].title()
+
+def extract_countries(affiliates):
+    """ extract_country sur une Series: chaque affilie distinct n'est resolu qu'une fois """
+    resolved = {affiliate: extract_country(affiliate) for affiliate in affiliates.dropna().unique()}
+    return affiliates.map(resolved)
@@ -1,297 +1,624 @@
+import numpy as np
 import pandas as pd
-from countries import get_country_map, extract_country
-from helper import get_filepath,get_real_filename,get_filepath_to_execute,update_file_status,create_extractions_table_if_not_exists,insert_extraction_data,create_extractions_questions_table_if_not_exists,insert_extraction_questions_data, calculate_station_scores, get_station_code_by_name,create_hse_variant_table_if_not_exists, insert_hse_variant_data
-from fuzzywuzzy import fuzz
+from countries import get_country_map, extract_countries
+from helper import get_filepath,create_extractions_table_if_not_exists,insert_extraction_data,create_extractions_questions_table_if_not_exists,insert_extraction_questions_data, calculate_station_scores, get_station_code_by_name, frame_to_rows,create_hse_variant_table_if_not_exists, insert_hse_variant_data, infer_column_types, INGEST_STATS, HSE_SCORE_COLUMNS, HSE_ROLLUP_ATTRIBUTE_COLUMNS, create_hse_rollup_table_if_not_exists, insert_hse_rollup_data, STATION_DIMENSION_COLUMNS, create_dimension_tables_if_not_exists, drop_staging_tables, publish_staged_tables, report_job_progress, create_station_matches_table_if_not_exists, get_station_matches, upsert_station_matches, claim_pending_files, release_stale_claims, find_completed_duplicate, update_file_content_hash, update_file_status_by_id, get_upload_filepath, create_ingest_context
+from sheets import INGEST_CHUNK_ROWS, open_workbook, resolve_sheet_name, iter_sheet_chunks
+from sheet_cache import compute_content_hash, parse_to_cache, is_cached, iter_cached_sheet_chunks, evict_sheet_cache
 from openpyxl import load_workbook
-from rapidfuzz import fuzz, process
+from station_matching import build_affiliate_station_map, match_stations
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
 import time
 
-FILE_PATH = get_filepath_to_execute()
 ORIGINAL_PATH = get_filepath("Invariants.xlsx")
 
-start_time = time.time()
+# nombre de fichiers en attente extraits en parallele
+INGEST_PARALLEL_FILES = int(os.getenv("INGEST_PARALLEL_FILES", 2))
+# un fichier reste 'processing' plus longtemps que ca est considere abandonne
+INGEST_CLAIM_TIMEOUT_SECONDS = int(os.getenv("INGEST_CLAIM_TIMEOUT_SECONDS", 3600))
 
-xls = pd.ExcelFile(FILE_PATH)
-sheet_names = xls.sheet_names
-
-def load_sheet(sheet_name):
-    return sheet_name, pd.read_excel(xls, sheet_name=sheet_name)
-
-sheets = {}
-with ThreadPoolExecutor(max_workers=3) as executor:
-    futures = [executor.submit(load_sheet, name) for name in ["Inspections", "Questions", "HSE Invariants"]]
-    for future in as_completed(futures):
-        sheet_name, df = future.result()
-        sheets[sheet_name] = df
-
-df = sheets.get("Inspections", pd.read_excel(xls, sheet_name=0))
-questions_df = sheets["Questions"]
-hse_variant_df = sheets["HSE Invariants"]
-
-print(f"Chargee {len(sheets)} feuilles en {time.time() - start_time:.2f}s")
+COUNTRY_MAP = get_country_map()
 
-def clean_dataframe(df):
-    """Nettoyer les colonnes et les valeurs d'un dataframe en une seule passe"""
-    df.columns = df.columns.str.strip().str.lower()
-    
-    object_cols = df.select_dtypes(include="object").columns
-    df[object_cols] = df[object_cols].apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-    
-    return df
+# fichiers reclames par cette extraction et pas encore termines: {id: contexte d'ingestion, None avant sa creation}
+CLAIMED_FILES = {}
+CLAIMED_FILES_LOCK = threading.Lock()
+# pose par SIGTERM: les workers ne reclament plus de fichier et n'ecrivent plus de statut
+SHUTDOWN_REQUESTED = threading.Event()
 
-COUNTRY_MAP = get_country_map()
+# creation/migration des tables (DDL) serialisee entre les fichiers extraits en parallele
+TABLES_LOCK = threading.Lock()
 
 def process_affiliate_and_country(df):
-    df["affiliate"] = df["affiliate"].apply(extract_country)
+    df["affiliate"] = extract_countries(df["affiliate"])
     df["country_code"] = df["affiliate"].str.lower().map(COUNTRY_MAP)
     return df
 
 def prepare_data_for_db(df):
-    """ nettoyer les donnees pour enlever les champs null """
-    df_clean = df.copy()
-    
-    # Remplacer NaN avec None pour compatibiliter de type null dans la bd
-    df_clean = df_clean.where(pd.notna(df_clean), None)
-    
-    for col in df_clean.select_dtypes(include=['float64', 'float32']).columns:
-        if df_clean[col].notna().any():
-            if (df_clean[col].dropna() % 1 == 0).all():
-                df_clean[col] = df_clean[col].astype('Int64')
-    
-    return df_clean
-
-print("Traitement des données d'extraction")
-df = clean_dataframe(df)
-filtered_df = df[df["inspector"].str.lower() == "all"].copy()
-filtered_df = process_affiliate_and_country(filtered_df)
-
-filtered_df = prepare_data_for_db(filtered_df)
-extraction_data = filtered_df.to_dict(orient="records")
+    """ colonnes d'entiers stockees en float (a cause des NaN) converties en Int64; les NaN deviennent None dans frame_to_rows """
+    df_clean = df.copy(deep=False)
 
-print("Traitement des données relatives aux questions")
-questions_df = clean_dataframe(questions_df)
-questions_df = process_affiliate_and_country(questions_df)
+    for position, col in enumerate(df_clean.columns):
+        values = df_clean.iloc[:, position]
+        if values.dtype in ('float64', 'float32') and values.notna().any():
+            if (values.dropna() % 1 == 0).all():
+                df_clean.isetitem(position, values.astype('Int64'))
 
-# Vectorized column filtering
-columns_to_keep = ["zone", "sub-zone", "affiliate", "station name", "station code", "d.02", "ep11"]
-questions_df = questions_df[[col for col in columns_to_keep if col in questions_df.columns]]
-
-questions_df = prepare_data_for_db(questions_df)
-questions_data = questions_df.to_dict(orient="records")
-
-print("Calcul des scores des stations")
-stations_scores = calculate_station_scores(questions_data)
-
-
-print("Traitement des variantes HSE")
-hse_variant_df = clean_dataframe(hse_variant_df)
-hse_variant_df = process_affiliate_and_country(hse_variant_df)
-hse_variant_dict = hse_variant_df.to_dict(orient="records")
-
-# Create a lookup dictionary for HSE variant data by station code
-hse_lookup = {}
-for hse_row in hse_variant_dict:
-    station_code = hse_row.get("station code")
-    if station_code:
-        hse_lookup[station_code] = hse_row
+    return df_clean
 
-hse_variant_data = questions_df.to_dict(orient="records")
+def partial_hse_rollup(df):
+    """ agregats additifs par station d'un lot de variantes HSE: sommes/comptes des 25 scores, attributs, comptes AFR et lignes """
+    station_codes = df["station code"].fillna("").rename("station code")
+    scores = df.reindex(columns=HSE_SCORE_COLUMNS).apply(pd.to_numeric, errors="coerce")
+
+    grouped_scores = scores.groupby(station_codes)
+    attribute_columns = [col for col in HSE_ROLLUP_ATTRIBUTE_COLUMNS if col != "station code"]
+    attributes = df.reindex(columns=attribute_columns).groupby(station_codes).first()
+    afr_count = (df["zone"] == "AFR").groupby(station_codes).sum() if "zone" in df.columns else 0
+
+    partial = pd.concat([
+        attributes,
+        grouped_scores.sum(min_count=1).add_suffix("_sum"),
+        grouped_scores.count().add_suffix("_count")
+    ], axis=1)
+    partial["afr_count"] = afr_count
+    partial["row_count"] = station_codes.groupby(station_codes).size()
+    return partial
+
+def combine_hse_rollups(partials):
+    """ fusionne des agregats partiels (lecture en flux): premiers attributs, sommes et comptes additionnes """
+    partials = [partial for partial in partials if partial is not None]
+    if len(partials) == 1:
+        return partials[0]
+
+    grouped = pd.concat(partials).groupby(level=0)
+    attribute_columns = [col for col in HSE_ROLLUP_ATTRIBUTE_COLUMNS if col != "station code"]
+    sum_columns = [f"{col}_sum" for col in HSE_SCORE_COLUMNS]
+    count_columns = [f"{col}_count" for col in HSE_SCORE_COLUMNS] + ["afr_count", "row_count"]
+    return pd.concat([
+        grouped[attribute_columns].first(),
+        grouped[sum_columns].sum(min_count=1),
+        grouped[count_columns].sum()
+    ], axis=1)
+
+def finalize_hse_rollup(partial):
+    """ ajoute la moyenne de la station = moyenne des 25 moyennes de colonnes, NULL si une colonne n'a aucune valeur """
+    sums = partial[[f"{col}_sum" for col in HSE_SCORE_COLUMNS]].to_numpy(dtype=float)
+    counts = partial[[f"{col}_count" for col in HSE_SCORE_COLUMNS]].to_numpy(dtype=float)
+    column_means = pd.DataFrame(sums / np.where(counts > 0, counts, np.nan), index=partial.index)
+    station_mean = column_means.sum(axis=1, min_count=len(HSE_SCORE_COLUMNS)) / len(HSE_SCORE_COLUMNS)
+
+    rollup = partial.copy()
+    rollup.insert(rollup.columns.get_loc("afr_count"), "station_mean", station_mean)
+    return rollup.reset_index()
+
+def build_hse_rollup(df):
+    """ agreger les variantes HSE par station: sommes/comptes des 25 scores, moyenne de la station, compte AFR """
+    return finalize_hse_rollup(partial_hse_rollup(df))
+
+def prepare_inspections(df):
+    filtered_df = df[df["inspector"].str.lower() == "all"].copy()
+    filtered_df = process_affiliate_and_country(filtered_df)
+    return prepare_data_for_db(filtered_df)
+
+def prepare_questions(df):
+    questions_df = process_affiliate_and_country(df)
+
+    # Vectorized column filtering
+    columns_to_keep = ["zone", "sub-zone", "affiliate", "station name", "station code", "d.02", "ep11"]
+    questions_df = questions_df[[col for col in columns_to_keep if col in questions_df.columns]]
+
+    return prepare_data_for_db(questions_df)
+
+def build_hse_lookup(df):
+    """ une ligne HSE par station (la derniere l'emporte) """
+    hse_df = process_affiliate_and_country(df)
+    hse_lookup_df = hse_df[hse_df["station code"].notna() & (hse_df["station code"] != "")]
+    return hse_lookup_df.drop_duplicates(subset="station code", keep="last")
+
+def build_hse_variants(questions_df, hse_lookup_df):
+    """ variantes HSE: questions + score ep11 de la station + colonnes HSE absentes des questions """
+    stations_scores = calculate_station_scores(questions_df)
+    hse_lookup_df = hse_lookup_df[["station code"] + [col for col in hse_lookup_df.columns if col not in questions_df.columns]]
+
+    hse_variant_df = questions_df.copy()
+    hse_variant_df["ep11"] = hse_variant_df["station code"].map(stations_scores)
+    hse_variant_df = hse_variant_df.merge(hse_lookup_df, on="station code", how="left")
+    return prepare_data_for_db(hse_variant_df)
+
+def latest_station_rows(df):
+    """ Dimension des stations (/get-filters): derniere ligne de chaque station """
+    stations_df = df.reindex(columns=STATION_DIMENSION_COLUMNS)
+    return stations_df[stations_df["station code"].notna()].drop_duplicates(subset="station code", keep="last")
+
+def prepare_file_data(sheets):
+    """ transforme les feuilles d'un rapport en DataFrames et records prets pour la base """
+    print("Traitement des données d'extraction")
+    filtered_df = prepare_inspections(sheets["Inspections"])
+
+    print("Traitement des données relatives aux questions")
+    questions_df = prepare_questions(sheets["Questions"])
+
+    print("Traitement des variantes HSE")
+    hse_variant_df = build_hse_variants(questions_df, build_hse_lookup(sheets["HSE Invariants"]))
+
+    print("Calcul des agregats HSE par station")
+    hse_rollup_df = prepare_data_for_db(build_hse_rollup(hse_variant_df))
+
+    return {
+        "filtered_df": filtered_df,
+        "questions_df": questions_df,
+        "hse_variant_df": hse_variant_df,
+        "extraction_rows": frame_to_rows(filtered_df),
+        "questions_rows": frame_to_rows(questions_df),
+        "hse_variant_rows": frame_to_rows(hse_variant_df),
+        "hse_rollup_rows": frame_to_rows(hse_rollup_df),
+        "stations_rows": frame_to_rows(latest_station_rows(hse_variant_df))
+    }
 
-for row in hse_variant_data:
-    station_code = row.get("station code")
-    if station_code and station_code in stations_scores:
-        row["ep11"] = stations_scores[station_code]
-    else:
-        row["ep11"] = None
-        
-    # Add all columns from hse_variant_df for this station
-    if station_code and station_code in hse_lookup:
-        hse_row_data = hse_lookup[station_code]
-        # Add all EP, ES, ET, Score columns from hse_variant_df
-        for key, value in hse_row_data.items():
-            # Skip columns that are already in row (to avoid overwriting)
-            if key not in row:
-                row[key] = value
-
-print("Création de la tables hse_variantes dans la base de données")
-db_start = time.time()
-
-def create_table_safe(table_func, data):
+def create_table_safe(table_func, df):
     try:
-        if not data:
+        if df.empty:
             print("Aucune donnée pour créer la table")
             return False
-        
-        # Filter out None keys and clean column names
-        valid_keys = [k for k in data[0].keys() if k is not None and str(k).lower() != 'nan']
-        table_func(valid_keys)
+
+        # Types SQL inferes des dtypes du DataFrame nettoye (colonnes None/'nan' ignorees)
+        table_func(infer_column_types(df))
         return True
     except Exception as e:
         print(f"Erreur lors de la création de la table: {e}")
         return False
 
-with ThreadPoolExecutor(max_workers=3) as executor:
-    futures = [
-        executor.submit(create_table_safe, create_extractions_table_if_not_exists, extraction_data),
-        executor.submit(create_table_safe, create_extractions_questions_table_if_not_exists, questions_data),
-        executor.submit(create_table_safe, create_hse_variant_table_if_not_exists, hse_variant_data)
-    ]
-    
-    for future in as_completed(futures):
-        future.result()
+def create_tables(table_frames, with_aggregates=True):
+    """ cree/migre les tables des (fonction, DataFrame) donnes, puis les tables d'agregats et de dimensions """
+    db_start = time.time()
+
+    with TABLES_LOCK:
+        if table_frames:
+            with ThreadPoolExecutor(max_workers=len(table_frames)) as executor:
+                futures = [executor.submit(create_table_safe, table_func, df) for table_func, df in table_frames]
 
-print(f"✅ Tables created in {time.time() - db_start:.2f}s")
+                for future in as_completed(futures):
+                    future.result()
 
-print("💾 Inserting data into database...")
-insert_start = time.time()
+        if with_aggregates:
+            try:
+                create_hse_rollup_table_if_not_exists()
+                create_dimension_tables_if_not_exists()
+            except Exception as e:
+                print(f"Erreur lors de la création des tables des agregats et dimensions: {e}")
 
-def clean_record_for_insertion(record):
-    return {k: v for k, v in record.items() 
-            if k is not None and str(k).lower() != 'nan' and pd.notna(k)}
+    return time.time() - db_start
 
-def insert_with_logging(insert_func, data, name):
+def insert_with_logging(insert_func, data, context, name):
+    """ insere des TableRows (colonnes fixes, tuples de valeurs deja nettoyes) et journalise le resultat """
     try:
-        # Pour les variantes HSE, aucun nettoyage supplémentaire n'est nécessaire 
-        # car les données proviennent de questions_df, qui est déjà nettoyé.
-        # Assurez-vous simplement qu'il n'y a pas de valeurs NaN dans les enregistrements.
-        cleaned_data = []
-        for record in data:
-            cleaned_record = {}
-            for k, v in record.items():
-                # Skip None keys and 'nan' string keys
-                if k is None or str(k).lower() == 'nan':
-                    continue
-                # Convert NaN values to None
-                if isinstance(v, float) and pd.isna(v):
-                    cleaned_record[k] = None
-                else:
-                    cleaned_record[k] = v
-            if cleaned_record:
-                cleaned_data.append(cleaned_record)
-        
-        if not cleaned_data:
+        if not data.rows:
             print(f"{name}: aucun records valide à insérer")
             return False
-            
-        insert_func(cleaned_data)
-        print(f"  ✅ {name}: {len(cleaned_data)} records insérés")
+
+        inserted = insert_func(data, context)
+        print(f"  ✅ {name}: {inserted}/{len(data.rows)} records insérés")
+        report_job_progress(rows=inserted)
         return True
     except Exception as e:
         print(f"{name} insertion echouer: {e}")
-        if data:
-            print(f"Sample record keys: {list(data[0].keys())[:10]}")
-            print(f"Sample values: {list(data[0].values())[:5]}")
+        if data.rows:
+            print(f"Sample record keys: {list(data.columns)[:10]}")
+            print(f"Sample values: {list(data.rows[0])[:5]}")
         return False
 
-# Insérer toutes les données en parallèle
-with ThreadPoolExecutor(max_workers=3) as executor:
-    insert_futures = {
-        executor.submit(insert_with_logging, insert_extraction_data, extraction_data, "Extraction data"): "extraction",
-        executor.submit(insert_with_logging, insert_extraction_questions_data, questions_data, "Questions data"): "questions",
-        executor.submit(insert_with_logging, insert_hse_variant_data, hse_variant_data, "HSE variant data"): "hse"
-    }
-    
-    # Wait for all insertions to complete
-    for future in as_completed(insert_futures):
-        data_type = insert_futures[future]
-        success = future.result()
-
-print(f"Toutes les données insereer dans: {time.time() - insert_start:.2f}s")
-
-print(f"\nToutes les données insereer dans: {time.time() - start_time:.2f}s")
-print("=" * 50)
-
-hse_update_data = calculate_station_scores(questions_data)
-station_name_and_codes = get_station_code_by_name(hse_variant_data)
-
-affiliate_station_map = {}
-for station_name, station_code in station_name_and_codes.items():
-    affiliate = station_code[:2].upper()
-    if affiliate not in affiliate_station_map:
-        affiliate_station_map[affiliate] = {}
-    affiliate_station_map[affiliate][station_name.lower()] = station_code
-
-wb = load_workbook(ORIGINAL_PATH)
-ws = wb.active
-
-header_row_idx = 5
-affiliate_col_idx = None
-cost_center_col_idx = None
-name_col_idx = None
-
-for col_idx, cell in enumerate(ws[header_row_idx], start=1):
-    header_value = str(cell.value).lower().strip() if cell.value else ""
-    
-    if "affiliate" in header_value:
-        affiliate_col_idx = col_idx
-    elif "cost center" in header_value or "cost centre" in header_value:
-        cost_center_col_idx = col_idx
-    elif header_value == "name" or "name" in header_value:
-        name_col_idx = col_idx
-
-if not all([affiliate_col_idx, cost_center_col_idx, name_col_idx]):
-    print(f"Colonne: Affiliate={affiliate_col_idx}, Cost Center={cost_center_col_idx}, Name={name_col_idx}")
-    raise ValueError("Impossible de trouver les colonnes requises")
-
-data_start_row = 6
-rows_to_process = []
-
-for row_idx in range(data_start_row, ws.max_row + 1):
-    inv_station_name = str(ws.cell(row_idx, name_col_idx).value or "").strip()
-    inv_affiliate = str(ws.cell(row_idx, affiliate_col_idx).value or "").strip()
-    
-    if inv_station_name and inv_affiliate:
-        rows_to_process.append((row_idx, inv_station_name, inv_affiliate))
-
-def match_station(row_data):
-    row_idx, inv_station_name, inv_affiliate = row_data
-    inv_affiliate_upper = inv_affiliate.upper()
-    
-    if inv_affiliate_upper not in affiliate_station_map:
-        return None
-    
-    affiliate_stations = affiliate_station_map[inv_affiliate_upper]
-    inv_name_lower = inv_station_name.lower()
-    
-    result = process.extractOne(
-        inv_name_lower,
-        affiliate_stations.keys(),
-        scorer=fuzz.token_set_ratio,
-        score_cutoff=70
-    )
-    
-    if result:
-        matched_name, score, _ = result
-        station_code = affiliate_stations[matched_name]
-        return (row_idx, station_code, inv_station_name, matched_name, score)
-    
-    return None
-
-matches_found = 0
-updates = []
-
-max_workers = min(8, len(rows_to_process) // 10 + 1)
-
-with ThreadPoolExecutor(max_workers=max_workers) as executor:
-    future_to_row = {executor.submit(match_station, row_data): row_data for row_data in rows_to_process}
-    
-    for future in as_completed(future_to_row):
-        result = future.result()
-        if result:
-            row_idx, station_code, orig_name, matched_name, score = result
-            updates.append((row_idx, station_code))
-            matches_found += 1
-            
-            if matches_found % 50 == 0:
-                print(f"  ... {matches_found} résultats trouvés")
+def insert_or_raise(insert_func, data, context, name):
+    """ une table de staging incomplete ne doit jamais etre publiee: un echec d'insertion fait echouer le fichier """
+    if not insert_with_logging(insert_func, data, context, name) and data.rows:
+        raise RuntimeError(f"{name}: insertion echouee, fichier non publie")
+
+def insert_file_data(prepared, context):
+    """ charge les donnees d'un fichier dans ses tables de staging puis les publie ensemble; True si le fichier est publie """
+    print("💾 Inserting data into database...")
+    insert_start = time.time()
+
+    # Insérer toutes les données en parallèle, chaque table dans sa table de staging
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        insert_futures = {
+            executor.submit(insert_with_logging, insert_extraction_data, prepared["extraction_rows"], context, "Extraction data"): ("extraction", prepared["extraction_rows"]),
+            executor.submit(insert_with_logging, insert_extraction_questions_data, prepared["questions_rows"], context, "Questions data"): ("questions", prepared["questions_rows"]),
+            executor.submit(insert_with_logging, insert_hse_variant_data, prepared["hse_variant_rows"], context, "HSE variant data"): ("hse", prepared["hse_variant_rows"])
+        }
+
+        # Wait for all insertions to complete
+        insert_results = {}
+        failed = []
+        for future in as_completed(insert_futures):
+            data_type, data = insert_futures[future]
+            success = future.result()
+            insert_results[data_type] = success
+            if not success and data.rows:
+                failed.append(data_type)
+
+    # rien n'est publie si les variantes HSE manquent ou si une table n'est chargee qu'en partie
+    if not insert_results.get("hse") or failed:
+        print(f"Fichier non publie (echecs: {', '.join(failed) or 'hse'})")
+        return False
+    if not insert_with_logging(insert_hse_rollup_data, prepared["hse_rollup_rows"], context, "HSE rollup data"):
+        return False
+
+    report_job_progress(f"{context.filename}: publication des données")
+    publish_staged_tables(context, prepared["stations_rows"])
+
+    print(f"Toutes les données insereer dans: {time.time() - insert_start:.2f}s")
+    return True
+
+def ingest_file(context, chunk_rows=0):
+    """ extrait un fichier reclame, a la date figee lors de la reclamation; renvoie ses noms -> codes de stations """
+    if chunk_rows > 0:
+        return ingest_file_in_chunks(context, chunk_rows)
+
+    filename = context.filename
+    start_time = time.time()
+
+    # feuilles deja analysees au depot: lues depuis le cache Parquet, sinon analysees puis mises en cache
+    report_job_progress(f"{filename}: lecture des feuilles")
+    sheets, _ = parse_to_cache(context.path, context.content_hash)
+    print(f"{filename}: chargee {len(sheets)} feuilles en {time.time() - start_time:.2f}s")
+
+    report_job_progress(f"{filename}: préparation des données")
+    prepared = prepare_file_data(sheets)
+
+    report_job_progress(f"{filename}: création des tables")
+    print("Création de la tables hse_variantes dans la base de données")
+    elapsed = create_tables([
+        (create_extractions_table_if_not_exists, prepared["filtered_df"]),
+        (create_extractions_questions_table_if_not_exists, prepared["questions_df"]),
+        (create_hse_variant_table_if_not_exists, prepared["hse_variant_df"])
+    ])
+    print(f"✅ Tables created in {elapsed:.2f}s")
+
+    report_job_progress(f"{filename}: insertion des données")
+    if not insert_file_data(prepared, context):
+        raise RuntimeError(f"les variantes HSE de {filename} n'ont pas pu etre inserees")
+
+    print(f"{filename}: extrait en {time.time() - start_time:.2f}s")
+    return get_station_code_by_name(prepared["hse_variant_df"])
+
+def ingest_file_in_chunks(context, chunk_rows):
+    """ lecture en flux par morceaux de chunk_rows lignes: seuls les agregats par station restent en memoire """
+    filename = context.filename
+    start_time = time.time()
+
+    content_hash = context.content_hash
+    if is_cached(content_hash):
+        station_name_and_codes = ingest_chunks(
+            filename, context, lambda sheet_name: iter_cached_sheet_chunks(content_hash, sheet_name, chunk_rows)
+        )
+    else:
+        with open_workbook(context.path) as wb:
+            station_name_and_codes = ingest_chunks(
+                filename, context, lambda sheet_name: iter_sheet_chunks(wb, resolve_sheet_name(wb, sheet_name) if sheet_name == "Inspections" else sheet_name, chunk_rows)
+            )
+
+    print(f"{filename}: extrait en flux en {time.time() - start_time:.2f}s")
+    return station_name_and_codes
+
+def ingest_chunks(filename, context, read_chunks):
+    """ insere les morceaux des feuilles renvoyes par read_chunks(nom de feuille), puis l'agregat et la dimension """
+    # les variantes HSE sont completees par station: leur table de correspondance est lue en premier
+    report_job_progress(f"{filename}: lecture des variantes HSE")
+    hse_lookup_df = None
+    for chunk in read_chunks("HSE Invariants"):
+        chunk_lookup = build_hse_lookup(chunk)
+        hse_lookup_df = chunk_lookup if hse_lookup_df is None else pd.concat([hse_lookup_df, chunk_lookup]).drop_duplicates(subset="station code", keep="last")
+
+    report_job_progress(f"{filename}: insertion des inspections")
+    for chunk in read_chunks("Inspections"):
+        filtered_df = prepare_inspections(chunk)
+        if filtered_df.empty:
+            continue
+        create_tables([(create_extractions_table_if_not_exists, filtered_df)], with_aggregates=False)
+        insert_or_raise(insert_extraction_data, frame_to_rows(filtered_df), context, "Extraction data")
+
+    report_job_progress(f"{filename}: insertion des questions et variantes HSE")
+    rollup_partial = None
+    stations_df = None
+    station_name_and_codes = {}
+    for chunk in read_chunks("Questions"):
+        questions_df = prepare_questions(chunk)
+        hse_variant_df = build_hse_variants(questions_df, hse_lookup_df)
+
+        create_tables([
+            (create_extractions_questions_table_if_not_exists, questions_df),
+            (create_hse_variant_table_if_not_exists, hse_variant_df)
+        ], with_aggregates=False)
+        insert_or_raise(insert_extraction_questions_data, frame_to_rows(questions_df), context, "Questions data")
+        if not insert_with_logging(insert_hse_variant_data, frame_to_rows(hse_variant_df), context, "HSE variant data"):
+            raise RuntimeError(f"les variantes HSE de {filename} n'ont pas pu etre inserees")
+
+        rollup_partial = combine_hse_rollups([rollup_partial, partial_hse_rollup(hse_variant_df)])
+        chunk_stations_df = latest_station_rows(hse_variant_df)
+        stations_df = chunk_stations_df if stations_df is None else latest_station_rows(pd.concat([stations_df, chunk_stations_df]))
+        station_name_and_codes.update(get_station_code_by_name(hse_variant_df))
+
+    # agregat charge une fois toutes les variantes HSE du fichier en staging, puis publication de tout le fichier
+    if rollup_partial is not None:
+        create_tables([])
+        hse_rollup_rows = frame_to_rows(prepare_data_for_db(finalize_hse_rollup(rollup_partial)))
+        insert_or_raise(insert_hse_rollup_data, hse_rollup_rows, context, "HSE rollup data")
+        report_job_progress(f"{filename}: publication des données")
+        publish_staged_tables(context, frame_to_rows(stations_df))
+    else:
+        raise RuntimeError(f"aucune variante HSE dans {filename}, fichier non publie")
+
+    return station_name_and_codes
+
+def skip_duplicate_file(claimed_file):
+    """ un depot identique octet pour octet a un fichier deja extrait pour la meme date n'est pas re-extrait """
+    if not claimed_file.get("content_hash"):
+        claimed_file["content_hash"] = compute_content_hash(get_upload_filepath(claimed_file["filename"]))
+        update_file_content_hash(claimed_file["id"], claimed_file["content_hash"])
 
-print(f"\nTotal des résultats trouvés: {matches_found}")
-print(f"Écriture {len(updates)} mises à jour vers Excel")
+    duplicate = find_completed_duplicate(claimed_file["id"], claimed_file["content_hash"], claimed_file["date_created"])
+    if duplicate is None:
+        return False
+
+    update_file_status_by_id(claimed_file["id"], 'completed')
+    print(f"'{claimed_file['filename']}' identique a '{duplicate['filename']}' deja extrait pour le {claimed_file['date_created']}: ignore")
+    return True
+
+def track_claimed_file(file_id, context=None):
+    """ enregistre un fichier reclame; pendant un arret, le remet en attente et renvoie False """
+    with CLAIMED_FILES_LOCK:
+        if SHUTDOWN_REQUESTED.is_set():
+            update_file_status_by_id(file_id, 'pending')
+            return False
+        CLAIMED_FILES[file_id] = context
+        return True
 
-for row_idx, station_code in updates:
-    ws.cell(row_idx, cost_center_col_idx).value = station_code
+def finish_claimed_file(file_id, status):
+    """ statut final d'un fichier reclame, sauf pendant un arret (le gestionnaire de SIGTERM l'a remis en attente) """
+    with CLAIMED_FILES_LOCK:
+        CLAIMED_FILES.pop(file_id, None)
+        if SHUTDOWN_REQUESTED.is_set():
+            return False
+        update_file_status_by_id(file_id, status)
+        return True
 
-wb.save(ORIGINAL_PATH)
+def release_claimed_files(signum, frame):
+    """ SIGTERM (annulation du job): remet en attente les fichiers reclames et supprime leurs tables de staging """
+    with CLAIMED_FILES_LOCK:
+        SHUTDOWN_REQUESTED.set()
+        claimed = list(CLAIMED_FILES.items())
+    # statuts d'abord (UPDATE rapide): un DROP TABLE bloque par une publication en cours peut depasser le delai avant kill
+    for file_id, _ in claimed:
+        try:
+            update_file_status_by_id(file_id, 'pending')
+        except Exception as e:
+            print(f"Liberation du fichier {file_id} impossible: {e}")
+    print(f"Extraction interrompue: {len(claimed)} fichier(s) remis en attente")
+    sys.stdout.flush()
+    for file_id, context in claimed:
+        try:
+            if context is not None:
+                drop_staging_tables(context)
+        except Exception as e:
+            print(f"Suppression des tables de staging du fichier {file_id} impossible: {e}")
+    sys.stdout.flush()
+    # les threads d'extraction sont arretes avec le processus; une publication en cours est annulee par MySQL
+    os._exit(128 + signum)
+
+def drain_pending_files(results, results_lock, chunk_rows=0):
+    """ boucle d'un worker: reclame et extrait les fichiers en attente un par un jusqu'a epuisement """
+    while not SHUTDOWN_REQUESTED.is_set():
+        claimed = claim_pending_files(1)
+        if not claimed:
+            return
+
+        claimed_file = claimed[0]
+        if not track_claimed_file(claimed_file["id"]):
+            return
+        try:
+            if skip_duplicate_file(claimed_file):
+                continue
+            context = create_ingest_context(claimed_file)
+            if not track_claimed_file(claimed_file["id"], context):
+                return
+            # tables de staging laissees par une extraction interrompue de ce fichier
+            drop_staging_tables(context)
+            try:
+                # seuls les noms/codes des stations sont gardes pour la correspondance Invariants
+                station_name_and_codes = ingest_file(context, chunk_rows)
+            finally:
+                drop_staging_tables(context)
+            if not finish_claimed_file(claimed_file["id"], 'completed'):
+                return
+            print(f"Mise a jour du status du fichier '{claimed_file['filename']}' to 'completed'")
+            with results_lock:
+                results.append((context, station_name_and_codes))
+        except Exception as e:
+            if finish_claimed_file(claimed_file["id"], 'failed'):
+                print(f"Extraction du fichier '{claimed_file['filename']}' echouee: {e}")
+        finally:
+            with CLAIMED_FILES_LOCK:
+                CLAIMED_FILES.pop(claimed_file["id"], None)
+
+def normalize_invariants_name(name):
+    """ cle de correspondance: minuscules, espaces normalises """
+    return " ".join(str(name).lower().split())
+
+def get_station_set_hash(affiliate_stations):
+    """ signature des stations d'un affilie: une correspondance enregistree n'est reutilisee que si elles n'ont pas change """
+    sha1 = hashlib.sha1()
+    for station_name, station_code in sorted(affiliate_stations.items()):
+        sha1.update(f"{station_name}\t{station_code}\n".encode("utf-8"))
+    return sha1.hexdigest()
+
+def read_invariants_rows(file_path):
+    """ lignes (ligne, affilie, nom, cost center actuel) du fichier Invariants, lu en lecture seule """
+    with open_workbook(file_path) as wb:
+        ws = wb.active
+        header_row_idx = 5
+        affiliate_col_idx = None
+        cost_center_col_idx = None
+        name_col_idx = None
+
+        header = next(ws.iter_rows(min_row=header_row_idx, max_row=header_row_idx, values_only=True), ())
+        for col_idx, value in enumerate(header, start=1):
+            header_value = str(value).lower().strip() if value else ""
+
+            if "affiliate" in header_value:
+                affiliate_col_idx = col_idx
+            elif "cost center" in header_value or "cost centre" in header_value:
+                cost_center_col_idx = col_idx
+            elif header_value == "name" or "name" in header_value:
+                name_col_idx = col_idx
+
+        if not all([affiliate_col_idx, cost_center_col_idx, name_col_idx]):
+            print(f"Colonne: Affiliate={affiliate_col_idx}, Cost Center={cost_center_col_idx}, Name={name_col_idx}")
+            raise ValueError("Impossible de trouver les colonnes requises")
+
+        data_start_row = 6
+        rows = []
+        for row_idx, values in enumerate(ws.iter_rows(min_row=data_start_row, values_only=True), start=data_start_row):
+            def cell_value(col_idx):
+                return values[col_idx - 1] if col_idx <= len(values) else None
+
+            inv_station_name = str(cell_value(name_col_idx) or "").strip()
+            inv_affiliate = str(cell_value(affiliate_col_idx) or "").strip()
+            if inv_station_name and inv_affiliate:
+                rows.append((row_idx, inv_affiliate.upper(), inv_station_name, cell_value(cost_center_col_idx)))
+
+    return rows, cost_center_col_idx
+
+def resolve_station_matches(invariants_rows, affiliate_station_map):
+    """ {(affilie, nom normalise): code ou None}: correspondances enregistrees reutilisees, seuls les noms nouveaux ou dont les stations de l'affilie ont change sont re-scores """
+    create_station_matches_table_if_not_exists()
+    station_set_hashes = {
+        affiliate: get_station_set_hash(stations) for affiliate, stations in affiliate_station_map.items()
+    }
+    keys = {(affiliate, normalize_invariants_name(name)) for _, affiliate, name, _ in invariants_rows}
+    # affilies sans station dans les rapports: rien a rapprocher, comme avant
+    keys = {key for key in keys if key[0] in station_set_hashes}
+    stored = get_station_matches(sorted({affiliate for affiliate, _ in keys}))
+
+    resolved = {}
+    to_score = []
+    for key in sorted(keys):
+        match = stored.get(key)
+        if match is not None and match["station_set_hash"] == station_set_hashes[key[0]]:
+            resolved[key] = match["station_code"]
+        else:
+            to_score.append(key)
+
+    matched_at = datetime.now().replace(microsecond=0)
+    rows_to_process = [(index, name, affiliate) for index, (affiliate, name) in enumerate(to_score)]
+    best = {}
+    for index, _, candidates in match_stations(rows_to_process, affiliate_station_map):
+        best[index] = candidates
+
+    match_rows = []
+    for index, (affiliate, name) in enumerate(to_score):
+        candidates = best.get(index, [])
+        station_code, matched_name, score = candidates[0] if candidates else (None, None, None)
+        resolved[(affiliate, name)] = station_code
+        match_rows.append((
+            affiliate, name, station_code, matched_name, score,
+            json.dumps([[code, candidate_name, round(float(candidate_score), 2)] for code, candidate_name, candidate_score in candidates]),
+            station_set_hashes[affiliate], matched_at
+        ))
+    upsert_station_matches(match_rows)
+
+    print(f"Correspondances Invariants: {len(keys) - len(to_score)} reutilisee(s), {len(to_score)} re-scoree(s)")
+    return resolved
+
+def save_workbook_atomically(wb, file_path):
+    """ ecrit dans un fichier temporaire du meme dossier puis le renomme: les lecteurs ne voient jamais un fichier partiel """
+    fd, tmp_path = tempfile.mkstemp(prefix=".invariants-", suffix=".xlsx", dir=os.path.dirname(file_path))
+    os.close(fd)
+    try:
+        wb.save(tmp_path)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def update_invariants_cost_centers(station_name_and_codes):
+    """ renseigne les cost centers du fichier Invariants par correspondance approximative des noms de stations """
+    report_job_progress("correspondance des stations Invariants")
+
+    affiliate_station_map = build_affiliate_station_map(station_name_and_codes)
+    invariants_rows, cost_center_col_idx = read_invariants_rows(ORIGINAL_PATH)
+    resolved = resolve_station_matches(invariants_rows, affiliate_station_map)
+
+    matches_found = 0
+    updates = []
+    for row_idx, affiliate, name, current_code in invariants_rows:
+        station_code = resolved.get((affiliate, normalize_invariants_name(name)))
+        if station_code is None:
+            continue
+        matches_found += 1
+        if current_code is None or str(current_code) != station_code:
+            updates.append((row_idx, station_code))
 
-update_file_status(get_real_filename(FILE_PATH),'completed')
\ No newline at end of file
+    print(f"\nTotal des résultats trouvés: {matches_found}")
+    if not updates:
+        print("Aucun cost center modifié: fichier Invariants inchangé")
+        return
+
+    print(f"Écriture {len(updates)} mises à jour vers Excel")
+    report_job_progress("mise à jour du fichier Invariants")
+    wb = load_workbook(ORIGINAL_PATH)
+    ws = wb.active
+    for row_idx, station_code in updates:
+        ws.cell(row_idx, cost_center_col_idx).value = station_code
+    save_workbook_atomically(wb, ORIGINAL_PATH)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraction des rapports ERIS en attente")
+    parser.add_argument("--parallel-files", type=int, default=INGEST_PARALLEL_FILES,
+                        help="nombre de fichiers en attente extraits en parallele")
+    parser.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS,
+                        help="lecture en flux par morceaux de N lignes (0 = feuilles chargees entieres)")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    # annulation via /jobs/<id>/cancel: process.terminate() de jobs.py
+    signal.signal(signal.SIGTERM, release_claimed_files)
+    release_stale_claims(INGEST_CLAIM_TIMEOUT_SECONDS)
+
+    results = []
+    results_lock = threading.Lock()
+    workers = max(1, args.parallel_files)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(drain_pending_files, results, results_lock, args.chunk_rows) for _ in range(workers)]
+        for future in as_completed(futures):
+            future.result()
+
+    # feuilles mises en cache par l'extraction des fichiers dont le job 'parse' n'avait pas tourne
+    evict_sheet_cache()
+
+    if not results:
+        print('Aucun fichier deposer ...')
+        return
+
+    for table_name, stats in INGEST_STATS.items():
+        print(f"  {table_name}: {stats['rows_per_second']:.0f} lignes/s ({stats['rows']} lignes en {stats['seconds']}s, {stats['unchanged']} inchangees)")
+
+    print(f"\n{len(results)} fichier(s) extrait(s) en: {time.time() - start_time:.2f}s")
+    print("=" * 50)
+
+    # une seule correspondance Invariants pour tous les fichiers; le rapport le plus recent l'emporte
+    results.sort(key=lambda result: result[0].date)
+    station_name_and_codes = {}
+    for _, file_station_codes in results:
+        station_name_and_codes.update(file_station_codes)
+    update_invariants_cost_centers(station_name_and_codes)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
 import os
+import re
 import mysql.connector
+from mysql.connector import pooling
+import numpy as np
+import pandas as pd
 from datetime import datetime
 import math
+import hashlib
+from collections import namedtuple
+from decimal import Decimal
+import tempfile
+import threading
+import time
 
 from dotenv import load_dotenv
 
@@ -20,6 +30,48 @@ DB_CONFIG = {
     "database": DB_NAME
 }
 
+# connexions partagees par les threads d'une extraction (fichiers en parallele, insertions par table)
+DB_POOL_SIZE = min(int(os.getenv("DB_POOL_SIZE", 10)), pooling.CNX_POOL_MAXSIZE)
+# attente maximale d'une connexion libre quand toutes sont empruntees
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30))
+
+# chargement en masse: lots d'upserts multi-lignes au lieu d'un INSERT par ligne
+INGEST_BULK_MODE = os.getenv("INGEST_BULK_MODE", "1") == "1"
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+# chemin rapide LOAD DATA LOCAL INFILE (le serveur doit avoir local_infile=ON)
+INGEST_LOAD_DATA_INFILE = os.getenv("INGEST_LOAD_DATA_INFILE", "0") == "1"
+# lignes identiques a celles de la date de rapport precedente recopiees cote serveur au lieu d'etre renvoyees
+INGEST_DELTA = os.getenv("INGEST_DELTA", "1") == "1"
+
+# debit d'insertion par table (lignes, secondes, lignes/s) du dernier chargement
+INGEST_STATS = {}
+
+CONNECTION_POOL = None
+CONNECTION_POOL_LOCK = threading.Lock()
+
+def get_connection_pool():
+    """ pool cree a la premiere connexion: un script qui n'utilise pas la base ne s'y connecte pas """
+    global CONNECTION_POOL
+    with CONNECTION_POOL_LOCK:
+        if CONNECTION_POOL is None:
+            CONNECTION_POOL = pooling.MySQLConnectionPool(
+                pool_name="extraction", pool_size=DB_POOL_SIZE, pool_reset_session=True,
+                allow_local_infile=INGEST_LOAD_DATA_INFILE, **DB_CONFIG
+            )
+        return CONNECTION_POOL
+
+def get_connection():
+    """ connexion empruntee au pool; conn.close() la rend au pool au lieu de la fermer """
+    pool = get_connection_pool()
+    deadline = time.time() + DB_POOL_TIMEOUT_SECONDS
+    while True:
+        try:
+            return pool.get_connection()
+        except pooling.PoolError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.05)
+
 def get_filepath(filename="ERIS_Report_Extraction_15_09_2025.xlsx"):
     backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     input_dir = os.path.join(backend_dir, "input")
@@ -44,221 +96,941 @@ def get_filepath_to_execute():
     except:
       print('Aucun fichier deposer ...')
 
-def calculate_station_scores(data):
-    station_scores = {}
+def normalize_answers(values):
+    """ reponses en minuscules sans espaces; NaN et la chaine 'nan' deviennent manquantes """
+    text = values.astype(str)
+    missing = values.isna() | (text.str.lower() == "nan")
+    return text.str.strip().str.lower().where(~missing)
 
-    for row in data:
-        station_code = row.get("station code")
-        d02 = row.get("d.02")
-        ep11 = row.get("ep11")
-
-        d02_str = str(d02).strip().lower() if d02 is not None and str(d02).lower() != 'nan' else None
-        ep11_str = str(ep11).strip().lower() if ep11 is not None and str(ep11).lower() != 'nan' else None
-
-        if d02_str == "yes":
-            score = 0
-        elif d02_str == "no":
-            score = 100
-        elif d02_str is None:
-            if ep11_str == "yes":
-                score = 100
-            elif ep11_str == "no":
-                score = 0
-            else:
-                score = '' 
-        else:
-            score = ''
+def calculate_station_scores(df):
+    """ score ep11 de chaque station: 0/100 selon d.02, a defaut selon ep11; la derniere ligne de la station l'emporte """
+    d02 = normalize_answers(df["d.02"] if "d.02" in df.columns else pd.Series(None, index=df.index, dtype=object))
+    ep11 = normalize_answers(df["ep11"] if "ep11" in df.columns else pd.Series(None, index=df.index, dtype=object))
 
-        if station_code:
-            station_scores[station_code] = score
+    scores = np.select(
+        [d02 == "yes", d02 == "no", d02.isna() & (ep11 == "yes"), d02.isna() & (ep11 == "no")],
+        [0, 100, 100, 0],
+        default=np.nan
+    )
+    station_scores = pd.DataFrame({"station code": df["station code"], "score": scores})
+    station_scores = station_scores[station_scores["station code"].notna() & (station_scores["station code"] != "")]
+    return station_scores.drop_duplicates(subset="station code", keep="last").set_index("station code")["score"]
 
-    return station_scores
+def get_station_code_by_name(df):
+    return dict(zip(df["station name"], df["station code"]))
 
-def get_station_code_by_name(data):
-    station_name_codes = {}
+# cle naturelle de chaque table: une ligne par valeur de cle, re-inserer la met a jour
+TABLE_NATURAL_KEYS = {
+    "extractions": ("date", "zone", "sub-zone", "affiliate"),
+    "extraction_questions": ("date", "station code"),
+    "hse_variants": ("date", "station code"),
+    "hse_variant_rollups": ("date", "station code")
+}
 
-    for row in data:
-        station_name = row.get("station name")
-        station_name_codes[station_name] = row.get("station code")
+# tables de faits partitionnees par date de rapport: supprimer une date revient a supprimer sa partition
+PARTITIONED_TABLES = list(TABLE_NATURAL_KEYS)
+NULL_DATE_PARTITION = "p_null"
+ER_SAME_NAME_PARTITION = 1517
+
+# index composites des filtres du tableau de bord (les predicats sur `date` sont des egalites directes)
+# et index de lignage: les lignes d'un fichier depose sont supprimees par `file_upload_id`
+TABLE_INDEXES = {
+    "extractions": {
+        "idx_extractions_date_zone": ("date", "zone", "sub-zone"),
+        "idx_extractions_file_upload_id": ("file_upload_id",)
+    },
+    "extraction_questions": {
+        "idx_extraction_questions_file_upload_id": ("file_upload_id",)
+    },
+    "hse_variants": {
+        "idx_hse_variants_filters": ("date", "zone", "sub-zone", "affiliate", "station code"),
+        "idx_hse_variants_file_upload_id": ("file_upload_id",)
+    },
+    "hse_variant_rollups": {
+        "idx_hse_variant_rollups_filters": ("date", "zone", "sub-zone", "affiliate", "station code"),
+        "idx_hse_variant_rollups_file_upload_id": ("file_upload_id",)
+    }
+}
+
+# les 25 scores EP/ES/ET moyennes par le tableau de bord
+HSE_SCORE_COLUMNS = (
+    [f"ep{i:02d}" for i in range(1, 12)]
+    + [f"es{i:02d}" for i in range(1, 10)]
+    + [f"et{i:02d}" for i in range(1, 6)]
+)
+HSE_ROLLUP_ATTRIBUTE_COLUMNS = ["zone", "sub-zone", "affiliate", "station code", "station name"]
+
+# type d'une colonne entierement vide dans le fichier
+DEFAULT_COLUMN_TYPE = "VARCHAR(64)"
+# colonnes gerees par l'ingestion, jamais inferees
+MANAGED_COLUMNS = ("date", "timestamp", "file_upload_id", "row_key", "row_hash")
+SQL_TYPE_RANKS = {"smallint": 1, "int": 2, "bigint": 3, "decimal": 4, "double": 5, "varchar": 6, "text": 7}
+LEGACY_COLUMN_TYPE = "VARCHAR(255)"
+# longueur maximale du texte d'une valeur numerique ("-9223372036854775808", "-1.7976931348623157e+308")
+NUMERIC_TEXT_WIDTHS = {"smallint": 6, "int": 11, "bigint": 20, "double": 24}
+NUMERIC_VALUE_REGEXP = "^-?[0-9]+([.][0-9]+)?$"
+
+def infer_column_types(df):
+    """ type SQL de chaque colonne d'un DataFrame nettoye (None si la colonne est vide) """
+    return {col: infer_sql_type(df[col]) for col in df.columns
+            if col is not None and str(col).lower() != 'nan' and col not in MANAGED_COLUMNS}
+
+def infer_sql_type(series):
+    values = series.dropna()
+    if values.empty:
+        return None
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return "SMALLINT"
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return "DATETIME"
+
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        numeric_values = pd.to_numeric(values, errors="coerce")
+        if numeric_values.isna().any():
+            return varchar_type(values.astype(str).str.len().max())
+        values = numeric_values
+
+    return numeric_type(values.min(), values.max(), bool((values % 1 == 0).all()))
+
+def numeric_type(min_value, max_value, is_integer):
+    if is_integer:
+        if -32768 <= min_value and max_value <= 32767:
+            return "SMALLINT"
+        if -2147483648 <= min_value and max_value <= 2147483647:
+            return "INT"
+        return "BIGINT"
+    if max(abs(min_value), abs(max_value)) < 10 ** 8:
+        return "DECIMAL(12,4)"
+    return "DOUBLE"
+
+def varchar_type(max_length):
+    length = 16
+    while length < max_length:
+        length *= 2
+    if length > 1024:
+        return "TEXT"
+    return f"VARCHAR({length})"
+
+def normalize_sql_type(sql_type):
+    sql_type = sql_type.strip().lower()
+    # largeur d'affichage des entiers (MySQL 5.7: smallint(6))
+    sql_type = re.sub(r"^(smallint|int|bigint)\(\d+\)", r"\1", sql_type)
+    return sql_type.upper()
+
+def sql_type_rank(sql_type):
+    return SQL_TYPE_RANKS.get(normalize_sql_type(sql_type).split("(")[0].lower(), len(SQL_TYPE_RANKS) + 1)
+
+def varchar_length(sql_type):
+    match = re.search(r"\((\d+)\)", sql_type)
+    return int(match.group(1)) if match else 0
+
+def numeric_text_width(sql_type):
+    """ longueur maximale d'une valeur d'un type numerique une fois convertie en texte """
+    sql_type = normalize_sql_type(sql_type).lower()
+    if sql_type.startswith("decimal"):
+        # signe et point decimal en plus des chiffres
+        match = re.search(r"\((\d+)", sql_type)
+        return (int(match.group(1)) if match else 10) + 2
+    return NUMERIC_TEXT_WIDTHS.get(sql_type, 0)
 
-    return station_name_codes
+def widest_sql_type(current_type, new_type):
+    """ type capable de contenir les valeurs des deux types """
+    if current_type is None:
+        return new_type
+    if new_type is None:
+        return current_type
+    current_rank = sql_type_rank(current_type)
+    new_rank = sql_type_rank(new_type)
+    varchar_rank = SQL_TYPE_RANKS["varchar"]
+    if current_rank == new_rank == varchar_rank:
+        return varchar_type(max(varchar_length(current_type), varchar_length(new_type)))
+    # numerique et VARCHAR: les valeurs numeriques deviennent du texte, le VARCHAR doit contenir le plus long
+    if current_rank < varchar_rank == new_rank:
+        return varchar_type(max(varchar_length(new_type), numeric_text_width(current_type)))
+    if new_rank < varchar_rank == current_rank:
+        return varchar_type(max(varchar_length(current_type), numeric_text_width(new_type)))
+    return normalize_sql_type(current_type if current_rank >= new_rank else new_type)
+
+def get_table_column_types(cursor, table_name):
+    cursor.execute(
+        "SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+        (table_name,)
+    )
+    return {row[0]: normalize_sql_type(row[1]) for row in cursor.fetchall()}
+
+def legacy_column_type(cursor, table_name, column, inferred_type):
+    """ type cible d'une colonne VARCHAR(255) creee avant l'inference des types, selon ses donnees """
+    if sql_type_rank(inferred_type) < SQL_TYPE_RANKS["varchar"]:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM `{table_name}` WHERE `{column}` <> '' AND `{column}` NOT REGEXP %s",
+            (NUMERIC_VALUE_REGEXP,)
+        )
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                f"SELECT MIN(CAST(`{column}` AS DECIMAL(30,4))), MAX(CAST(`{column}` AS DECIMAL(30,4))), "
+                f"SUM(CAST(`{column}` AS DECIMAL(30,4)) <> FLOOR(CAST(`{column}` AS DECIMAL(30,4)))) "
+                f"FROM `{table_name}` WHERE `{column}` <> ''"
+            )
+            min_value, max_value, fractional = cursor.fetchone()
+            if min_value is None:
+                return inferred_type
+            return widest_sql_type(inferred_type, numeric_type(min_value, max_value, not fractional))
+        inferred_type = DEFAULT_COLUMN_TYPE
+
+    cursor.execute(f"SELECT MAX(CHAR_LENGTH(`{column}`)) FROM `{table_name}`")
+    return widest_sql_type(inferred_type, varchar_type(cursor.fetchone()[0] or 0))
+
+def migrate_column_types(cursor, table_name, column_types):
+    """ ajouter les nouvelles colonnes et elargir/typer les colonnes existantes """
+    existing_types = get_table_column_types(cursor, table_name)
+
+    for column, inferred_type in column_types.items():
+        current_type = existing_types.get(column)
+        if current_type is None:
+            cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN `{column}` {inferred_type or DEFAULT_COLUMN_TYPE}")
+            continue
+        if inferred_type is None:
+            continue
+
+        if current_type == LEGACY_COLUMN_TYPE and normalize_sql_type(inferred_type) != LEGACY_COLUMN_TYPE:
+            target_type = legacy_column_type(cursor, table_name, column, inferred_type)
+        else:
+            target_type = widest_sql_type(current_type, inferred_type)
 
-def create_extractions_table_if_not_exists(table_columns,table_name='extractions'):
-    conn = mysql.connector.connect(**DB_CONFIG)
+        if target_type == current_type:
+            continue
+
+        print(f"Migration de {table_name}.{column}: {current_type} -> {target_type}")
+        if sql_type_rank(target_type) < SQL_TYPE_RANKS["varchar"]:
+            cursor.execute(f"UPDATE `{table_name}` SET `{column}` = NULL WHERE `{column}` = ''")
+        cursor.execute(f"ALTER TABLE `{table_name}` MODIFY COLUMN `{column}` {target_type}")
+
+def get_table_columns(cursor, table_name):
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+        (table_name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def create_table_if_not_exists(column_types, table_name):
+    """ creer la table avec les types inferes du DataFrame, ou migrer la table existante """
+    conn = get_connection()
     cursor = conn.cursor()
 
-    columns_sql = ", ".join([f"`{col}` VARCHAR(255)" for col in table_columns])
+    columns_sql = ", ".join([f"`{col}` {sql_type or DEFAULT_COLUMN_TYPE}" for col, sql_type in column_types.items()])
     create_sql = f"""
     CREATE TABLE IF NOT EXISTS `{table_name}` (
         {columns_sql},
         `date` DATE,
-        `timestamp` DATETIME
+        `timestamp` DATETIME,
+        `file_upload_id` INT,
+        `row_key` CHAR(40),
+        `row_hash` CHAR(40),
+        UNIQUE KEY `uq_{table_name}_row_key` (`date`, `row_key`)
     )
     """
-    cursor.execute(create_sql)
-    conn.commit()
-    cursor.close()
-    
-def insert_extraction_data(data, table_name='extractions'):
-    conn = mysql.connector.connect(**DB_CONFIG)
-    cursor = conn.cursor()
-    file_creation_date = get_latest_pending_file_date()
-    current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cursor.execute(create_sql)
+        ensure_natural_key(cursor, table_name)
+        ensure_row_hash(cursor, table_name)
+        ensure_file_upload_id(cursor, table_name)
+        ensure_date_partitioning(cursor, table_name)
+        migrate_column_types(cursor, table_name, column_types)
+        ensure_indexes(cursor, table_name)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
 
-    for row in data:
-        row["date"] = file_creation_date
-        row["timestamp"] = current_timestamp
-
-        columns_to_check = [col for col in row.keys() if col != "timestamp"]
-
-        where_conditions = []
-        where_values = []
-        for col in columns_to_check:
-            if row[col] is None:
-                where_conditions.append(f"`{col}` IS NULL")
-            else:
-                where_conditions.append(f"`{col}` = %s")
-                where_values.append(row[col])
-
-        where_clause = " AND ".join(where_conditions)
-
-        check_sql = f"SELECT COUNT(*) FROM `{table_name}` WHERE {where_clause}"
-        cursor.execute(check_sql, where_values)
-        count = cursor.fetchone()[0]
-
-        if count == 0:
-            columns = ", ".join([f"`{col}`" for col in row.keys()])
-            placeholders = ", ".join(["%s"] * len(row))
-            values = list(row.values())
-            insert_sql = f"INSERT INTO `{table_name}` ({columns}) VALUES ({placeholders})"
-            cursor.execute(insert_sql, values)
-        else:
-            print(f"Skipped duplicate row for date {file_creation_date}")
+def ensure_natural_key(cursor, table_name):
+    """ migrer une table creee avant l'introduction de `row_key` """
+    existing_columns = get_table_columns(cursor, table_name)
+    if "row_key" in existing_columns:
+        return
+
+    print(f"Migration de {table_name}: ajout de la cle naturelle")
+    cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN `row_key` CHAR(40)")
+
+    # meme empreinte que compute_row_key(): valeurs separees par \x1f, NULL -> ''
+    key_columns = TABLE_NATURAL_KEYS.get(table_name) or [col for col in existing_columns if col != "timestamp"]
+    key_sql = ", ".join([f"COALESCE(CAST(`{col}` AS CHAR), '')" if col in existing_columns else "''" for col in key_columns])
+    cursor.execute(f"UPDATE `{table_name}` SET `row_key` = SHA1(CONCAT_WS(CHAR(31 USING utf8mb4), {key_sql}))")
+
+    cursor.execute(f"SELECT COUNT(*) - COUNT(DISTINCT `date`, `row_key`) FROM `{table_name}`")
+    duplicates = cursor.fetchone()[0]
+    if duplicates:
+        # garder la ligne la plus recente de chaque cle
+        print(f"Migration de {table_name}: suppression de {duplicates} doublons")
+        cursor.execute(f"CREATE TABLE `{table_name}_dedup` LIKE `{table_name}`")
+        cursor.execute(f"ALTER TABLE `{table_name}_dedup` ADD UNIQUE KEY `uq_{table_name}_row_key` (`date`, `row_key`)")
+        cursor.execute(f"INSERT IGNORE INTO `{table_name}_dedup` SELECT * FROM `{table_name}` ORDER BY `timestamp` DESC")
+        cursor.execute(f"RENAME TABLE `{table_name}` TO `{table_name}_old`, `{table_name}_dedup` TO `{table_name}`")
+        cursor.execute(f"DROP TABLE `{table_name}_old`")
+    else:
+        cursor.execute(f"ALTER TABLE `{table_name}` ADD UNIQUE KEY `uq_{table_name}_row_key` (`date`, `row_key`)")
+
+def ensure_row_hash(cursor, table_name):
+    """ migrer une table creee avant l'ingestion delta: les lignes existantes (row_hash NULL) sont considerees modifiees """
+    if "row_hash" not in get_table_columns(cursor, table_name):
+        print(f"Migration de {table_name}: ajout de l'empreinte des lignes")
+        cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN `row_hash` CHAR(40)")
+
+def ensure_file_upload_id(cursor, table_name):
+    """ migrer une table creee avant le lignage: ses lignes existantes (NULL) ne sont supprimees qu'avec leur date """
+    if "file_upload_id" not in get_table_columns(cursor, table_name):
+        print(f"Migration de {table_name}: ajout du fichier d'origine des lignes")
+        cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN `file_upload_id` INT AFTER `timestamp`")
+
+def get_date_partition_name(report_date):
+    return "p" + str(report_date)[:10].replace("-", "")
+
+def get_date_partition_sql(report_date):
+    return f"PARTITION `{get_date_partition_name(report_date)}` VALUES IN ('{str(report_date)[:10]}')"
+
+def get_table_partitions(cursor, table_name):
+    """ noms des partitions de la table ([] si elle n'est pas partitionnee) """
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.partitions "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND PARTITION_NAME IS NOT NULL",
+        (table_name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def ensure_date_partitioning(cursor, table_name):
+    """ partitionner par date (LIST COLUMNS) une table de faits creee sans partitions: une partition par date chargee """
+    if table_name not in PARTITIONED_TABLES or get_table_partitions(cursor, table_name):
+        return
+
+    cursor.execute(f"SELECT DISTINCT `date` FROM `{table_name}` WHERE `date` IS NOT NULL ORDER BY `date`")
+    report_dates = [row[0] for row in cursor.fetchall()]
+    # les lignes anterieures a la colonne date renseignee restent dans une partition NULL
+    partitions_sql = [f"PARTITION `{NULL_DATE_PARTITION}` VALUES IN (NULL)"] + [get_date_partition_sql(d) for d in report_dates]
+    print(f"Migration de {table_name}: partitionnement par date ({len(report_dates)} dates)")
+    cursor.execute(f"ALTER TABLE `{table_name}` PARTITION BY LIST COLUMNS(`date`) ({', '.join(partitions_sql)})")
+
+def ensure_date_partitions(cursor, table_name, report_dates):
+    """ ajoute les partitions des dates a charger: sans elle, l'insertion d'une date echoue """
+    existing_partitions = set(get_table_partitions(cursor, table_name))
+    if not existing_partitions:
+        return
+
+    for report_date in sorted(set(report_dates)):
+        if get_date_partition_name(report_date) in existing_partitions:
+            continue
+        try:
+            cursor.execute(f"ALTER TABLE `{table_name}` ADD PARTITION ({get_date_partition_sql(report_date)})")
+        except mysql.connector.Error as e:
+            # ajoutee entre-temps par l'extraction concurrente d'un fichier de la meme date
+            if e.errno != ER_SAME_NAME_PARTITION:
+                raise
+
+def ensure_indexes(cursor, table_name):
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s",
+        (table_name,)
+    )
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+    table_columns = get_table_columns(cursor, table_name)
+
+    for index_name, index_columns in TABLE_INDEXES.get(table_name, {}).items():
+        if index_name in existing_indexes:
+            continue
+        # un fichier sans une des colonnes ne doit pas bloquer l'ingestion
+        columns = [col for col in index_columns if col in table_columns]
+        if not columns:
+            continue
+        columns_sql = ", ".join([f"`{col}`" for col in columns])
+        try:
+            cursor.execute(f"ALTER TABLE `{table_name}` ADD INDEX `{index_name}` ({columns_sql})")
+            print(f"Index {index_name} cree sur {table_name}")
+        except mysql.connector.Error as e:
+            print(f"Impossible de creer l'index {index_name} sur {table_name}: {e}")
+
+def create_extractions_table_if_not_exists(column_types,table_name='extractions'):
+    create_table_if_not_exists(column_types, table_name)
+    
+def insert_extraction_data(data, context, table_name='extractions'):
+    return load_records(data, table_name, context)
+    
+    
+def create_extractions_questions_table_if_not_exists(column_types,table_name='extraction_questions'):
+    create_table_if_not_exists(column_types, table_name)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+def insert_extraction_questions_data(data, context, table_name='extraction_questions'):
+    return load_records(data, table_name, context)
     
+def create_hse_variant_table_if_not_exists(column_types,table_name='hse_variants'):
+    create_table_if_not_exists(column_types, table_name)
     
-def create_extractions_questions_table_if_not_exists(table_columns,table_name='extraction_questions'):
-    conn = mysql.connector.connect(**DB_CONFIG)
+def insert_hse_variant_data(data, context, table_name='hse_variants'):
+    return load_records(data, table_name, context)
+
+
+def create_hse_rollup_table_if_not_exists(table_name='hse_variant_rollups'):
+    """ agregats par date x station des scores HSE, lus par /get-statistics-by-filter """
+    column_types = {
+        "zone": "VARCHAR(64)",
+        "sub-zone": "VARCHAR(64)",
+        "affiliate": "VARCHAR(128)",
+        "station code": "VARCHAR(64)",
+        "station name": "VARCHAR(255)"
+    }
+    for col in HSE_SCORE_COLUMNS:
+        column_types[f"{col}_sum"] = "DECIMAL(14,4)"
+        column_types[f"{col}_count"] = "INT"
+    column_types["station_mean"] = "DECIMAL(12,4)"
+    column_types["afr_count"] = "INT"
+    column_types["row_count"] = "INT"
+
+    conn = get_connection()
     cursor = conn.cursor()
+    try:
+        is_new_table = not get_table_columns(cursor, table_name)
+        hse_columns = get_table_columns(cursor, "hse_variants")
+    finally:
+        cursor.close()
+        conn.close()
 
-    columns_sql = ", ".join([f"`{col}` VARCHAR(255)" for col in table_columns])
-    create_sql = f"""
-    CREATE TABLE IF NOT EXISTS `{table_name}` (
-        {columns_sql},
-        `date` DATE,
-        `timestamp` DATETIME
-    )
-    """
-    cursor.execute(create_sql)
-    conn.commit()
-    cursor.close()
+    create_table_if_not_exists(column_types, table_name)
+
+    if is_new_table and hse_columns:
+        backfill_hse_rollup(table_name, hse_columns)
 
-def insert_extraction_questions_data(data, table_name='extraction_questions'):
-    conn = mysql.connector.connect(**DB_CONFIG)
+def backfill_hse_rollup(table_name, hse_columns):
+    """ remplir l'agregat a partir des variantes HSE deja chargees """
+    conn = get_connection()
     cursor = conn.cursor()
-    file_creation_date = get_latest_pending_file_date()
-    current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    for row in data:
-        row["date"] = file_creation_date
-        row["timestamp"] = current_timestamp
-
-        columns_to_check = [col for col in row.keys() if col != "timestamp"]
-
-        where_conditions = []
-        where_values = []
-        for col in columns_to_check:
-            value = row[col]
-            if value is None or (isinstance(value, float) and math.isnan(value)):
-                where_conditions.append(f"`{col}` IS NULL")
-            else:
-                where_conditions.append(f"`{col}` = %s")
-                where_values.append(value)
-
-        where_clause = " AND ".join(where_conditions)
-
-        # Check for duplicates
-        check_sql = f"SELECT COUNT(*) FROM `{table_name}` WHERE {where_clause}"
-        cursor.execute(check_sql, where_values)
-        count = cursor.fetchone()[0]
-
-        if count == 0:
-            # Convert NaN to None for insert
-            cleaned_values = [None if (v is None or (isinstance(v, float) and math.isnan(v))) else v for v in row.values()]
-            columns = ", ".join([f"`{col}`" for col in row.keys()])
-            placeholders = ", ".join(["%s"] * len(row))
-            insert_sql = f"INSERT INTO `{table_name}` ({columns}) VALUES ({placeholders})"
-            cursor.execute(insert_sql, cleaned_values)
-        else:
-            print(f"Skipped duplicate row for date {file_creation_date}")
+    def column_or_null(col):
+        return f"`{col}`" if col in hse_columns else "NULL"
 
-    conn.commit()
-    cursor.close()
-    conn.close()
-    
-def create_hse_variant_table_if_not_exists(table_columns,table_name='hse_variants'):
-    conn = mysql.connector.connect(**DB_CONFIG)
+    attributes_sql = ", ".join([f"MAX({column_or_null(col)})" for col in ["zone", "sub-zone", "affiliate", "station name"]])
+    sums_sql = ", ".join([f"SUM({column_or_null(col)}), COUNT({column_or_null(col)})" for col in HSE_SCORE_COLUMNS])
+    mean_sql = " + ".join([f"AVG({column_or_null(col)})" for col in HSE_SCORE_COLUMNS])
+    target_columns = ["date", "zone", "sub-zone", "affiliate", "station name", "station code"]
+    target_columns += [name for col in HSE_SCORE_COLUMNS for name in (f"{col}_sum", f"{col}_count")]
+    target_columns += ["station_mean", "afr_count", "row_count", "timestamp", "row_key"]
+
+    try:
+        # INSERT IGNORE ecarterait sans erreur les lignes des dates sans partition
+        cursor.execute("SELECT DISTINCT `date` FROM hse_variants WHERE `date` IS NOT NULL")
+        ensure_date_partitions(cursor, table_name, [row[0] for row in cursor.fetchall()])
+        cursor.execute(f"""
+            INSERT IGNORE INTO `{table_name}` ({", ".join([f"`{col}`" for col in target_columns])})
+            SELECT `date`, {attributes_sql}, COALESCE(`station code`, ''), {sums_sql},
+                ({mean_sql}) / {len(HSE_SCORE_COLUMNS)},
+                SUM(CASE WHEN {column_or_null("zone")} = 'AFR' THEN 1 ELSE 0 END), COUNT(*), NOW(),
+                SHA1(CONCAT_WS(CHAR(31 USING utf8mb4), CAST(`date` AS CHAR), COALESCE(`station code`, '')))
+            FROM hse_variants
+            WHERE `date` IS NOT NULL
+            GROUP BY `date`, `station code`
+        """)
+        conn.commit()
+        print(f"{table_name}: {cursor.rowcount} agregats calcules depuis hse_variants")
+    except mysql.connector.Error as e:
+        conn.rollback()
+        print(f"Impossible de remplir {table_name} depuis hse_variants: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def insert_hse_rollup_data(data, context, table_name='hse_variant_rollups'):
+    return load_records(data, table_name, context)
+
+STATION_DIMENSION_COLUMNS = ["station code", "station name", "zone", "sub-zone", "affiliate", "country_code"]
+
+def create_dimension_tables_if_not_exists():
+    """ petites tables lues par /get-filters: une ligne par station et par date de rapport """
+    conn = get_connection()
     cursor = conn.cursor()
 
-    columns_sql = ", ".join([f"`{col}` VARCHAR(255)" for col in table_columns])
-    create_sql = f"""
-    CREATE TABLE IF NOT EXISTS `{table_name}` (
-        {columns_sql},
-        `date` DATE,
-        `timestamp` DATETIME
-    )
-    """
-    cursor.execute(create_sql)
-    conn.commit()
-    cursor.close()
-    
-def insert_hse_variant_data(data, table_name='hse_variants'):
-    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        is_new_stations = not get_table_columns(cursor, "stations")
+        is_new_report_dates = not get_table_columns(cursor, "report_dates")
+        hse_columns = get_table_columns(cursor, "hse_variants")
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `stations` (
+            `station code` VARCHAR(64) NOT NULL PRIMARY KEY,
+            `station name` VARCHAR(255),
+            `zone` VARCHAR(64),
+            `sub-zone` VARCHAR(64),
+            `affiliate` VARCHAR(128),
+            `country_code` VARCHAR(8),
+            `first_seen` DATE,
+            `last_seen` DATE,
+            INDEX `idx_stations_zone` (`zone`, `sub-zone`),
+            INDEX `idx_stations_name` (`station name`)
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `report_dates` (
+            `date` DATE NOT NULL PRIMARY KEY,
+            `station_count` INT,
+            `row_count` INT,
+            `updated_at` DATETIME
+        )
+        """)
+
+        try:
+            if is_new_stations and hse_columns:
+                def column_or_null(col):
+                    return f"`{col}`" if col in hse_columns else "NULL"
+
+                attributes_sql = ", ".join([f"MAX({column_or_null(col)})" for col in STATION_DIMENSION_COLUMNS[1:]])
+                cursor.execute(f"""
+                    INSERT IGNORE INTO `stations` (`station code`, `station name`, `zone`, `sub-zone`, `affiliate`, `country_code`, `first_seen`, `last_seen`)
+                    SELECT `station code`, {attributes_sql}, MIN(`date`), MAX(`date`)
+                    FROM hse_variants
+                    WHERE `station code` IS NOT NULL AND `station code` <> '' AND `date` IS NOT NULL
+                    GROUP BY `station code`
+                """)
+                print(f"stations: {cursor.rowcount} stations calculees depuis hse_variants")
+            if is_new_report_dates:
+                cursor.execute("SELECT DISTINCT `date` FROM hse_variant_rollups")
+                for (report_date,) in cursor.fetchall():
+                    refresh_report_date(cursor, report_date)
+            conn.commit()
+        except mysql.connector.Error as e:
+            conn.rollback()
+            print(f"Impossible de remplir les tables de dimensions: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+STATION_MATCH_COLUMNS = ["affiliate", "invariants_name", "station_code", "matched_name", "score", "candidates", "station_set_hash", "matched_at"]
+
+def create_station_matches_table_if_not_exists():
+    """ correspondances Invariants -> station par (affilie, nom Invariants normalise), reutilisees entre extractions """
+    conn = get_connection()
     cursor = conn.cursor()
-    file_creation_date = get_latest_pending_file_date()
-    current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `station_matches` (
+            `affiliate` VARCHAR(16) NOT NULL,
+            `invariants_name` VARCHAR(255) NOT NULL,
+            `station_code` VARCHAR(64),
+            `matched_name` VARCHAR(255),
+            `score` DECIMAL(6,2),
+            `candidates` TEXT,
+            `station_set_hash` CHAR(40) NOT NULL,
+            `matched_at` DATETIME NOT NULL,
+            PRIMARY KEY (`affiliate`, `invariants_name`)
+        )
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_station_matches(affiliates):
+    """ {(affilie, nom normalise): correspondance enregistree} des affilies donnes """
+    if not affiliates:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        placeholders = ", ".join(["%s"] * len(affiliates))
+        cursor.execute(
+            f"SELECT `affiliate`, `invariants_name`, `station_code`, `score`, `station_set_hash` FROM `station_matches` WHERE `affiliate` IN ({placeholders})",
+            list(affiliates)
+        )
+        return {(row["affiliate"], row["invariants_name"]): row for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+
+def upsert_station_matches(rows):
+    """ rows: tuples dans l'ordre de STATION_MATCH_COLUMNS; les lignes sans correspondance ont station_code NULL """
+    if not rows:
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        update_sql = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in STATION_MATCH_COLUMNS[2:]])
+        upsert_rows_in_batches(cursor, "station_matches", STATION_MATCH_COLUMNS, rows, update_sql=update_sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return len(rows)
+
+def refresh_report_date(cursor, report_date):
+    cursor.execute("""
+        INSERT INTO `report_dates` (`date`, `station_count`, `row_count`, `updated_at`)
+        SELECT `date`, COUNT(*), SUM(`row_count`), NOW()
+        FROM hse_variant_rollups
+        WHERE `date` = %s
+        GROUP BY `date`
+        ON DUPLICATE KEY UPDATE `station_count` = VALUES(`station_count`), `row_count` = VALUES(`row_count`), `updated_at` = VALUES(`updated_at`)
+    """, (report_date,))
+
+def upsert_station_dimension(cursor, data, file_creation_date):
+    """ upsert des stations du fichier et de sa date de rapport, dans la transaction du curseur """
+    if not isinstance(data, TableRows):
+        data = records_to_rows(data)
+    columns = STATION_DIMENSION_COLUMNS + ["first_seen", "last_seen"]
+    positions = [data.columns.index(col) if col in data.columns else None for col in STATION_DIMENSION_COLUMNS]
+    seen_dates = (file_creation_date, file_creation_date)
+    rows = [tuple(None if i is None else row[i] for i in positions) + seen_dates
+            for row in data.rows if positions[0] is not None and row[positions[0]]]
+
+    # les attributs viennent du rapport le plus recent; evalue avant la mise a jour de last_seen
+    attributes_sql = ", ".join([
+        f"`{col}` = IF(VALUES(`last_seen`) >= `last_seen`, VALUES(`{col}`), `{col}`)" for col in STATION_DIMENSION_COLUMNS[1:]
+    ])
+    update_sql = (f"{attributes_sql}, `first_seen` = LEAST(`first_seen`, VALUES(`first_seen`)), "
+                  f"`last_seen` = GREATEST(`last_seen`, VALUES(`last_seen`))")
+
+    upsert_rows_in_batches(cursor, "stations", columns, rows, update_sql=update_sql)
+    refresh_report_date(cursor, file_creation_date)
+    return len(rows)
 
+# tables de faits chargees d'abord dans des tables de staging propres au fichier, puis publiees ensemble
+STAGED_TABLES = list(TABLE_NATURAL_KEYS)
+
+def get_staging_table_name(table_name, context):
+    return f"{table_name}__staging_{context.file_id}"
+
+def ensure_staging_table(cursor, table_name, staging_table):
+    """ table de staging aux colonnes de la table vivante, sans index secondaire (seule la cle naturelle reste) """
+    live_types = get_table_column_types(cursor, table_name)
+    staging_types = get_table_column_types(cursor, staging_table)
+    if not staging_types:
+        cursor.execute(f"CREATE TABLE `{staging_table}` LIKE `{table_name}`")
+        # une seule date par fichier: les partitions de la table vivante n'ont pas d'interet en staging
+        if get_table_partitions(cursor, staging_table):
+            cursor.execute(f"ALTER TABLE `{staging_table}` REMOVE PARTITIONING")
+        cursor.execute(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s",
+            (staging_table,)
+        )
+        secondary_indexes = [row[0] for row in cursor.fetchall() if row[0] not in ("PRIMARY", f"uq_{table_name}_row_key")]
+        if secondary_indexes:
+            cursor.execute(f"ALTER TABLE `{staging_table}` " + ", ".join([f"DROP INDEX `{index}`" for index in secondary_indexes]))
+        return
+
+    # en flux, la table vivante peut avoir ete migree depuis la creation de la table de staging
+    for column, live_type in live_types.items():
+        if column not in staging_types:
+            cursor.execute(f"ALTER TABLE `{staging_table}` ADD COLUMN `{column}` {live_type}")
+        elif staging_types[column] != live_type:
+            cursor.execute(f"ALTER TABLE `{staging_table}` MODIFY COLUMN `{column}` {live_type}")
+
+def drop_staging_tables(context):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        for table_name in STAGED_TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS `{get_staging_table_name(table_name, context)}`")
+    finally:
+        cursor.close()
+        conn.close()
+
+def publish_staged_tables(context, stations_data=None):
+    """ copie les tables de staging du fichier dans les tables vivantes et met a jour les dimensions en une seule transaction """
+    start = time.time()
+    conn = get_connection()
+    cursor = conn.cursor()
+    published = []
+    try:
+        # DDL hors de la transaction de publication (un ALTER TABLE la validerait implicitement)
+        for table_name in STAGED_TABLES:
+            if get_table_columns(cursor, get_staging_table_name(table_name, context)):
+                ensure_date_partitions(cursor, table_name, [context.date])
+
+        conn.start_transaction()
+        for table_name in STAGED_TABLES:
+            staging_table = get_staging_table_name(table_name, context)
+            columns = get_table_columns(cursor, staging_table)
+            if not columns:
+                continue
+            column_list = ", ".join([f"`{col}`" for col in columns])
+            update_sql = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in columns if col not in ("date", "row_key")])
+            cursor.execute(
+                f"INSERT INTO `{table_name}` ({column_list}) SELECT {column_list} FROM `{staging_table}` "
+                f"ON DUPLICATE KEY UPDATE {update_sql}"
+            )
+            published.append(table_name)
+        if stations_data is not None:
+            upsert_station_dimension(cursor, stations_data, context.date)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"  {context.filename}: {', '.join(published)} publiees en {time.time() - start:.2f}s")
+    return published
+
+# fichier reclame en cours d'extraction: sa date de rapport et un horodatage communs a toutes ses tables
+IngestContext = namedtuple("IngestContext", ["file_id", "filename", "path", "content_hash", "date", "timestamp"])
+
+def create_ingest_context(claimed_file):
+    return IngestContext(
+        file_id=claimed_file["id"],
+        filename=claimed_file["filename"],
+        path=get_upload_filepath(claimed_file["filename"]),
+        content_hash=claimed_file.get("content_hash"),
+        date=claimed_file["date_created"],
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+# lignes pretes pour la base: ordre fixe des colonnes et tuples de valeurs (NaN -> None)
+TableRows = namedtuple("TableRows", ["columns", "rows"])
+
+def column_values(series):
+    """ valeurs Python d'une colonne depuis son tableau NumPy, NaN/NA/NaT -> None """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.astype(object).to_numpy()
+        values[series.isna().to_numpy()] = None
+        return values
+    return series.to_numpy(dtype=object, na_value=None)
+
+def frame_to_rows(df):
+    """ DataFrame -> TableRows colonne par colonne, sans dict intermediaire par ligne """
+    positions = [i for i, col in enumerate(df.columns) if col is not None and str(col).lower() != 'nan']
+    columns = [df.columns[i] for i in positions]
+    arrays = [column_values(df.iloc[:, i]) for i in positions]
+    return TableRows(columns, list(zip(*arrays)))
+
+def records_to_rows(data):
+    columns = get_record_columns(data)
+    return TableRows(columns, [tuple(clean_value(record.get(col)) for col in columns) for record in data])
+
+def clean_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+def get_record_columns(data):
+    """ colonnes de tous les records, dans l'ordre de premiere apparition """
+    columns = []
+    seen = set()
     for row in data:
-        row["date"] = file_creation_date
-        row["timestamp"] = current_timestamp
-
-        columns_to_check = [col for col in row.keys() if col != "timestamp"]
-
-        where_conditions = []
-        where_values = []
-        for col in columns_to_check:
-            value = row[col]
-            if value is None or (isinstance(value, float) and math.isnan(value)):
-                where_conditions.append(f"`{col}` IS NULL")
-            else:
-                where_conditions.append(f"`{col}` = %s")
-                where_values.append(value)
-
-        where_clause = " AND ".join(where_conditions)
-
-        check_sql = f"SELECT COUNT(*) FROM `{table_name}` WHERE {where_clause}"
-        cursor.execute(check_sql, where_values)
-        count = cursor.fetchone()[0]
-
-        if count == 0:
-            cleaned_values = [None if (v is None or (isinstance(v, float) and math.isnan(v))) else v for v in row.values()]
-            columns = ", ".join([f"`{col}`" for col in row.keys()])
-            placeholders = ", ".join(["%s"] * len(row))
-            insert_sql = f"INSERT INTO `{table_name}` ({columns}) VALUES ({placeholders})"
-            cursor.execute(insert_sql, cleaned_values)
-        else:
-            print(f"Skipped duplicate row for date {file_creation_date}")
+        for col in row.keys():
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    return columns
+
+def compute_row_key(values):
+    joined = "\x1f".join(["" if value is None else str(value) for value in values])
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+def hash_value_text(value):
+    """ texte d'une valeur pour l'empreinte: 100, 100.0 et Decimal('100.0000') donnent le meme texte, quel que soit
+        le dtype de la colonne ce jour-la (float64 des qu'elle contient un NaN) """
+    if value is None:
+        return ""
+    if isinstance(value, (bool, np.bool_)):
+        return str(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, Decimal):
+        if value == value.to_integral_value():
+            return str(int(value))
+        return format(value.normalize(), "f")
+    return str(value)
+
+def compute_row_hash(columns, values):
+    """ empreinte du contenu d'une ligne (noms et valeurs des colonnes de donnees), independante de la date """
+    joined = "\x1f".join([f"{col}={hash_value_text(value)}" for col, value in zip(columns, values)])
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+def get_previous_report_date(cursor, table_name, file_creation_date):
+    cursor.execute(f"SELECT MAX(`date`) FROM `{table_name}` WHERE `date` < %s", (file_creation_date,))
+    row = cursor.fetchone()
+    return row[0] if row else None
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+def get_row_hashes(cursor, table_name, report_date):
+    cursor.execute(f"SELECT `row_hash` FROM `{table_name}` WHERE `date` = %s AND `row_hash` IS NOT NULL", (report_date,))
+    return {row[0] for row in cursor.fetchall()}
+
+def copy_unchanged_rows(cursor, table_name, target_table, data_columns, row_hashes, previous_date, context, batch_size=None):
+    """ recopie cote serveur les lignes de previous_date vers la date du fichier dans target_table: seules leurs empreintes transitent """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    file_creation_date = context.date
+    key_columns = TABLE_NATURAL_KEYS[table_name]
+    # meme empreinte que compute_row_key(), avec la nouvelle date
+    key_sql = ", ".join(["%s" if col == "date" else f"COALESCE(CAST(`{col}` AS CHAR), '')" for col in key_columns])
+    key_params = [str(file_creation_date) for col in key_columns if col == "date"]
+    data_sql = ", ".join([f"`{col}`" for col in data_columns])
+    update_sql = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in data_columns + ["timestamp", "file_upload_id", "row_hash"]])
+
+    copied = 0
+    for start in range(0, len(row_hashes), batch_size):
+        batch = row_hashes[start:start + batch_size]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cursor.execute(
+            f"""
+            INSERT INTO `{target_table}` ({data_sql}, `date`, `timestamp`, `file_upload_id`, `row_key`, `row_hash`)
+            SELECT {data_sql}, %s, %s, %s, SHA1(CONCAT_WS(CHAR(31 USING utf8mb4), {key_sql})), `row_hash`
+            FROM `{table_name}`
+            WHERE `date` = %s AND `row_hash` IN ({placeholders})
+            ON DUPLICATE KEY UPDATE {update_sql}
+            """,
+            [file_creation_date, context.timestamp, context.file_id] + key_params + [previous_date] + list(batch)
+        )
+        copied += len(batch)
+    return copied
+
+def load_records(data, table_name, context, batch_size=None, use_load_data_infile=None):
+    """ upsert des lignes (TableRows, ou liste de records) d'un fichier dans une table et rapport du debit """
+    file_creation_date = context.date
+    current_timestamp = context.timestamp
+    if use_load_data_infile is None:
+        use_load_data_infile = INGEST_LOAD_DATA_INFILE
+    if not INGEST_BULK_MODE:
+        batch_size = 1
+    if not isinstance(data, TableRows):
+        data = records_to_rows(data)
+    start = time.time()
+
+    data_positions = [i for i, col in enumerate(data.columns) if col not in MANAGED_COLUMNS]
+    data_columns = [data.columns[i] for i in data_positions]
+    data_rows = data.rows
+    if len(data_positions) != len(data.columns):
+        data_rows = [tuple(row[i] for i in data_positions) for row in data_rows]
+
+    columns = data_columns + ["date", "timestamp", "file_upload_id", "row_key", "row_hash"]
+    key_columns = TABLE_NATURAL_KEYS.get(table_name) or data_columns + ["date"]
+    key_indexes = [columns.index(col) if col in columns else None for col in key_columns]
+
+    managed_values = (file_creation_date, current_timestamp, context.file_id)
+    rows = []
+    for values in data_rows:
+        row_hash = compute_row_hash(data_columns, values)
+        values = values + managed_values
+        rows.append(values + (compute_row_key([None if i is None else values[i] for i in key_indexes]), row_hash))
+
+    # les tables de faits sont chargees dans leur table de staging, publiee par publish_staged_tables()
+    target_table = get_staging_table_name(table_name, context) if table_name in STAGED_TABLES else table_name
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    unchanged = 0
+    try:
+        if target_table != table_name:
+            ensure_staging_table(cursor, table_name, target_table)
+        if INGEST_DELTA and table_name in TABLE_NATURAL_KEYS and rows:
+            previous_date = get_previous_report_date(cursor, table_name, file_creation_date)
+            previous_hashes = get_row_hashes(cursor, table_name, previous_date) if previous_date else set()
+            if previous_hashes:
+                # une ligne par cle naturelle (la derniere l'emporte, comme l'upsert), puis separation inchangees / nouvelles
+                rows = list({row[-2]: row for row in rows}.values())
+                unchanged_hashes = sorted({row[-1] for row in rows if row[-1] in previous_hashes})
+                rows = [row for row in rows if row[-1] not in previous_hashes]
+                unchanged = copy_unchanged_rows(
+                    cursor, table_name, target_table, data_columns, unchanged_hashes, previous_date, context, batch_size
+                )
+
+        loaded = False
+        if use_load_data_infile and rows:
+            try:
+                load_rows_from_infile(cursor, target_table, columns, rows)
+                loaded = True
+            except mysql.connector.Error as e:
+                print(f"LOAD DATA LOCAL INFILE indisponible pour {table_name}, insertion par lots: {e}")
+        if not loaded:
+            upsert_rows_in_batches(cursor, target_table, columns, rows, batch_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    report_ingest_throughput(table_name, len(rows) + unchanged, time.time() - start, unchanged)
+    return len(rows) + unchanged
+
+def upsert_rows_in_batches(cursor, table_name, columns, rows, batch_size=None, update_sql=None):
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    column_list = ", ".join([f"`{col}`" for col in columns])
+    row_placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    if update_sql is None:
+        update_sql = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in columns if col not in ("date", "row_key")])
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        values_sql = ", ".join([row_placeholders] * len(batch))
+        params = [value for row in batch for value in row]
+        cursor.execute(
+            f"INSERT INTO `{table_name}` ({column_list}) VALUES {values_sql} ON DUPLICATE KEY UPDATE {update_sql}",
+            params
+        )
+
+def escape_infile_value(value):
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r").replace("\0", "\\0"))
+
+def load_rows_from_infile(cursor, table_name, columns, rows):
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".tsv", delete=False) as tmp:
+        for row in rows:
+            tmp.write("\t".join(escape_infile_value(v) for v in row) + "\n")
+        tmp_path = tmp.name
+
+    try:
+        # REPLACE: une ligne existante avec la meme cle naturelle est remplacee
+        column_list = ", ".join([f"`{col}`" for col in columns])
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE `{table_name}` CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({column_list})",
+            (tmp_path,)
+        )
+    finally:
+        os.remove(tmp_path)
+
+def report_ingest_throughput(table_name, row_count, elapsed, unchanged=0):
+    rate = row_count / elapsed if elapsed > 0 else float(row_count)
+    INGEST_STATS[table_name] = {
+        "rows": row_count,
+        "unchanged": unchanged,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rate, 1)
+    }
+    print(f"  {table_name}: {row_count} lignes en {elapsed:.2f}s ({rate:.0f} lignes/s), dont {unchanged} inchangees recopiees")
     
     
+# job de jobs.py qui execute ce script (absent en execution manuelle)
+JOB_ID = os.getenv("JOB_ID")
+
+def report_job_progress(stage=None, rows=0):
+    """ publie l'etape courante et les lignes traitees dans la table jobs """
+    if not JOB_ID:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE jobs SET stage = COALESCE(%s, stage), rows_processed = rows_processed + %s, heartbeat_at = NOW()
+            WHERE id = %s
+            """,
+            (stage, rows or 0, JOB_ID)
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"Erreur lors de la mise a jour de l'avancement du job {JOB_ID}: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def get_latest_pending_file():
-    conn = mysql.connector.connect(**DB_CONFIG)
+    conn = get_connection()
     cursor = conn.cursor(dictionary=True)
     
     try:
@@ -284,36 +1056,120 @@ def get_latest_pending_file():
         cursor.close()
         conn.close()
         
-def get_latest_pending_file_date():
-    conn = mysql.connector.connect(**DB_CONFIG)
+def claim_pending_files(limit=1):
+    """ reclame atomiquement des fichiers en attente: verrou de ligne, statut 'processing', date figee """
+    conn = get_connection()
     cursor = conn.cursor(dictionary=True)
-    
+
     try:
-        query = """
-        SELECT filename, upload_date, date_created, file_size, filetype
+        conn.start_transaction()
+        # SKIP LOCKED: deux extractions concurrentes ne reclament jamais le meme fichier
+        cursor.execute("""
+        SELECT id, filename, date_created, content_hash
         FROM file_uploads
         WHERE file_status = 'pending'
         ORDER BY upload_date DESC
-        LIMIT 1
-        """
-        cursor.execute(query)
-        result = cursor.fetchone()
-        
-        if result:
-            return result['date_created']
-        else:
-            return None
-            
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """, (limit,))
+        claimed = cursor.fetchall()
+
+        if claimed:
+            placeholders = ", ".join(["%s"] * len(claimed))
+            cursor.execute(
+                f"UPDATE file_uploads SET file_status = 'processing' WHERE id IN ({placeholders})",
+                [row['id'] for row in claimed]
+            )
+        conn.commit()
+        return claimed
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur lors de la reclamation des fichiers en attente: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def release_stale_claims(timeout_seconds):
+    """ remet en attente les fichiers restes 'processing' apres une extraction interrompue """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+        UPDATE file_uploads
+        SET file_status = 'pending'
+        WHERE file_status = 'processing' AND updated_at < NOW() - INTERVAL %s SECOND
+        """, (timeout_seconds,))
+        conn.commit()
+        if cursor.rowcount > 0:
+            print(f"{cursor.rowcount} fichier(s) interrompu(s) remis en attente")
+        return cursor.rowcount
     except Exception as e:
-        print(f"Error fetching latest pending file creation date: {e}")
+        conn.rollback()
+        print(f"Erreur lors de la liberation des fichiers interrompus: {e}")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def find_completed_duplicate(file_id, content_hash, date_created):
+    """ autre depot deja extrait avec le meme contenu et la meme date de rapport, ou None """
+    if not content_hash:
         return None
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+        SELECT id, filename
+        FROM file_uploads
+        WHERE content_hash = %s AND date_created = %s AND file_status = 'completed' AND id <> %s
+        LIMIT 1
+        """, (content_hash, date_created, file_id))
+        return cursor.fetchone()
     finally:
         cursor.close()
         conn.close()
-        
+
+def update_file_content_hash(file_id, content_hash):
+    """ renseigne le hash des fichiers deposes avant son introduction """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE file_uploads SET content_hash = %s WHERE id = %s AND content_hash IS NULL", (content_hash, file_id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def update_file_status_by_id(file_id, new_status):
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("UPDATE file_uploads SET file_status = %s WHERE id = %s", (new_status, file_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"Error de mise a jour sur le status du fichier d'extraction: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_upload_filepath(filename):
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    file_path = os.path.join(backend_dir, "uploads", filename)
+
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"fichier {filename} pas trouver dans: {file_path}")
+
+    return file_path
 
 def update_file_status(filename, new_status):
-    conn = mysql.connector.connect(**DB_CONFIG)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sheets import REPORT_SHEETS, load_sheets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# feuilles analysees et nettoyees, en Parquet, par hash SHA-256 du contenu du fichier depose
+SHEET_CACHE_DIR = os.getenv("SHEET_CACHE_DIR", os.path.join(BACKEND_DIR, "cache", "sheets"))
+SHEET_CACHE_MAX_BYTES = int(os.getenv("SHEET_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+SHEET_CACHE_MAX_AGE_DAYS = int(os.getenv("SHEET_CACHE_MAX_AGE_DAYS", 30))
+# groupes de lignes Parquet: granularite de la lecture en flux depuis le cache
+SHEET_CACHE_ROW_GROUP_SIZE = 10000
+
+def compute_content_hash(file_path, block_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def get_cache_entry_dir(content_hash):
+    return os.path.join(SHEET_CACHE_DIR, content_hash)
+
+def get_cached_sheet_path(content_hash, sheet_name):
+    return os.path.join(get_cache_entry_dir(content_hash), f"{sheet_name}.parquet")
+
+def is_cached(content_hash):
+    return bool(content_hash) and all(os.path.exists(get_cached_sheet_path(content_hash, name)) for name in REPORT_SHEETS)
+
+def touch_cache_entry(content_hash):
+    # la date de modification du dossier sert de date de dernier acces pour l'eviction
+    try:
+        os.utime(get_cache_entry_dir(content_hash))
+    except OSError:
+        pass
+
+def load_cached_sheets(content_hash):
+    """ feuilles du cache (fichiers Parquet mappes en memoire), ou None si absentes """
+    if not is_cached(content_hash):
+        return None
+    sheets = {
+        sheet_name: pq.read_table(get_cached_sheet_path(content_hash, sheet_name), memory_map=True).to_pandas()
+        for sheet_name in REPORT_SHEETS
+    }
+    touch_cache_entry(content_hash)
+    return sheets
+
+def iter_cached_sheet_chunks(content_hash, sheet_name, chunk_rows):
+    """ lecture en flux d'une feuille du cache par lots d'au plus chunk_rows lignes """
+    parquet_file = pq.ParquetFile(get_cached_sheet_path(content_hash, sheet_name), memory_map=True)
+    touch_cache_entry(content_hash)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+        # le schema du fichier porte les metadonnees pandas (dtypes, index)
+        yield pa.Table.from_batches([batch], schema=parquet_file.schema_arrow).to_pandas()
+
+def store_sheets(content_hash, sheets):
+    """ ecrit les feuilles dans un dossier temporaire puis le renomme: une entree est complete ou absente """
+    os.makedirs(SHEET_CACHE_DIR, exist_ok=True)
+    entry_dir = get_cache_entry_dir(content_hash)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{content_hash}-", dir=SHEET_CACHE_DIR)
+    try:
+        for sheet_name in REPORT_SHEETS:
+            table = pa.Table.from_pandas(sheets[sheet_name], preserve_index=False)
+            pq.write_table(table, os.path.join(tmp_dir, f"{sheet_name}.parquet"), row_group_size=SHEET_CACHE_ROW_GROUP_SIZE)
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+def parse_to_cache(file_path, content_hash=None):
+    """ analyse un fichier depose une seule fois; renvoie ses feuilles (du cache si deja analyse) et son hash """
+    content_hash = content_hash or compute_content_hash(file_path)
+    sheets = load_cached_sheets(content_hash)
+    if sheets is not None:
+        return sheets, content_hash
+
+    start = time.time()
+    sheets = load_sheets(file_path)
+    try:
+        store_sheets(content_hash, sheets)
+        print(f"Feuilles de {os.path.basename(file_path)} mises en cache en {time.time() - start:.2f}s ({content_hash[:12]})")
+    except (pa.ArrowException, OSError) as e:
+        # le cache est une optimisation: l'extraction continue avec les feuilles analysees
+        print(f"Mise en cache des feuilles impossible: {e}")
+    return sheets, content_hash
+
+def get_dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+def evict_sheet_cache(max_bytes=None, max_age_days=None):
+    """ supprime les entrees non lues depuis max_age_days, puis les plus anciennes au-dela de max_bytes """
+    max_bytes = SHEET_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age_days = SHEET_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    if not os.path.isdir(SHEET_CACHE_DIR):
+        return 0
+
+    entries = []
+    for entry in os.scandir(SHEET_CACHE_DIR):
+        # les dossiers temporaires (".hash-xxx") sont en cours d'ecriture
+        if entry.is_dir() and not entry.name.startswith("."):
+            entries.append((entry.stat().st_mtime, get_dir_size(entry.path), entry.path))
+    entries.sort()
+
+    oldest_allowed = time.time() - max_age_days * 86400
+    total_bytes = sum(size for _, size, _ in entries)
+    evicted = 0
+    for last_access, size, path in entries:
+        if last_access >= oldest_allowed and total_bytes <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+        evicted += 1
+
+    if evicted:
+        print(f"{evicted} entree(s) evincee(s) du cache des feuilles")
+    return evicted
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache Parquet des feuilles des fichiers deposes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parse_parser = subparsers.add_parser("parse", help="analyser un fichier depose et mettre ses feuilles en cache")
+    parse_parser.add_argument("file_path")
+    parse_parser.add_argument("--content-hash", default=None)
+    # lance apres chaque job 'parse' et 'delete'; sans depot ni suppression, a planifier (cron) pour l'age maximal:
+    #   0 3 * * * cd <backend> && python scripts/sheet_cache.py evict
+    subparsers.add_parser("evict", help="appliquer les limites de taille et d'age du cache")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        parse_to_cache(args.file_path, args.content_hash)
+    # les limites s'appliquent aussi quand le fichier analyse etait deja en cache
+    evict_sheet_cache()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+# lignes par morceau en lecture en flux (0 = feuilles chargees entieres avec pd.read_excel)
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 0))
+
+# feuilles du rapport ERIS lues par l'extraction
+REPORT_SHEETS = ["Inspections", "Questions", "HSE Invariants"]
+
+# moteur de lecture des feuilles entieres: calamine (Rust, sans GIL) ou openpyxl
+SHEET_READER_ENGINE = os.getenv("SHEET_READER_ENGINE", "calamine")
+# processus de lecture (0 = selon os.cpu_count() et le nombre de grosses feuilles)
+SHEET_READER_WORKERS = int(os.getenv("SHEET_READER_WORKERS", 0))
+# taille XML decompressee a partir de laquelle une feuille est lue dans un processus dedie
+SHEET_PROCESS_MIN_BYTES = int(os.getenv("SHEET_PROCESS_MIN_BYTES", 8 * 1024 * 1024))
+
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+def clean_dataframe(df):
+    """Nettoyer les colonnes et les valeurs d'un dataframe en une seule passe"""
+    df.columns = df.columns.str.strip().str.lower()
+
+    object_cols = df.select_dtypes(include="object").columns
+    df[object_cols] = df[object_cols].apply(lambda x: x.str.strip() if x.dtype == "object" else x)
+
+    return df
+
+def get_reader_engine(engine=None):
+    """ moteur demande, ou openpyxl si python-calamine n'est pas installe """
+    engine = engine or SHEET_READER_ENGINE
+    if engine == "calamine" and not HAS_CALAMINE:
+        return "openpyxl"
+    return engine
+
+def get_sheet_sizes(file_path):
+    """ taille XML decompressee de chaque feuille, lue dans l'index du zip sans analyser le classeur """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+            relationships = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+            targets = {rel.get("Id"): rel.get("Target", "") for rel in relationships}
+
+            sizes = {}
+            for sheet in workbook.iter(f"{{{SPREADSHEET_NS}}}sheet"):
+                target = targets.get(sheet.get(f"{{{RELATIONSHIP_NS}}}id"), "")
+                part = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+                try:
+                    sizes[sheet.get("name")] = archive.getinfo(part).file_size
+                except KeyError:
+                    sizes[sheet.get("name")] = 0
+            return sizes
+    except (zipfile.BadZipFile, KeyError, ET.ParseError):
+        return None
+
+def get_sheet_workers(large_sheet_count, workers=None):
+    workers = workers or SHEET_READER_WORKERS or (os.cpu_count() or 1)
+    return max(1, min(workers, large_sheet_count))
+
+def read_sheet(file_path, sheet_name, engine):
+    """ lit une feuille entiere; execute aussi dans les processus du pool (fonction de module, picklable) """
+    try:
+        return pd.read_excel(file_path, sheet_name=sheet_name, engine=engine)
+    except Exception as e:
+        if engine == "openpyxl":
+            raise
+        print(f"Lecture {engine} de la feuille '{sheet_name}' impossible, repli sur openpyxl: {e}")
+        return pd.read_excel(file_path, sheet_name=sheet_name, engine="openpyxl")
+
+def load_sheets(file_path, engine=None, workers=None, process_min_bytes=None):
+    """ feuilles entieres du rapport, nettoyees; les grosses feuilles sont lues en parallele dans des processus """
+    engine = get_reader_engine(engine)
+    process_min_bytes = SHEET_PROCESS_MIN_BYTES if process_min_bytes is None else process_min_bytes
+    sizes = get_sheet_sizes(file_path) or {}
+
+    # meme repli que l'extraction: premiere feuille si "Inspections" est absente
+    source_names = {sheet_name: sheet_name for sheet_name in REPORT_SHEETS}
+    if sizes and "Inspections" not in sizes:
+        source_names["Inspections"] = next(iter(sizes))
+
+    # les plus grosses feuilles d'abord: elles bornent la duree totale
+    ordered = sorted(REPORT_SHEETS, key=lambda name: sizes.get(source_names[name], 0), reverse=True)
+    large = [name for name in ordered if sizes.get(source_names[name], 0) >= process_min_bytes]
+    workers = get_sheet_workers(len(large), workers)
+
+    sheets = {}
+    if workers > 1:
+        # spawn: le fork d'un processus multi-thread (extraction parallele des fichiers) peut bloquer
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(read_sheet, file_path, source_names[name], engine): name for name in large}
+            # les petites feuilles sont lues ici pendant que les processus analysent les grosses
+            for name in ordered:
+                if name not in large:
+                    sheets[name] = read_sheet(file_path, source_names[name], engine)
+            for future in as_completed(futures):
+                sheets[futures[future]] = future.result()
+    else:
+        for name in ordered:
+            sheets[name] = read_sheet(file_path, source_names[name], engine)
+
+    return {sheet_name: clean_dataframe(sheets[sheet_name]) for sheet_name in REPORT_SHEETS}
+
+@contextmanager
+def open_workbook(file_path):
+    """ classeur en lecture seule: les lignes sont lues a la demande, jamais tout le fichier """
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        yield wb
+    finally:
+        wb.close()
+
+def resolve_sheet_name(wb, sheet_name):
+    """ meme repli que l'extraction: premiere feuille si la feuille demandee est absente """
+    return sheet_name if sheet_name in wb.sheetnames else wb.sheetnames[0]
+
+def convert_cell(cell):
+    """ meme conversion que le lecteur openpyxl de pd.read_excel """
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
+
+def rows_to_dataframe(header, rows):
+    # TextParser est le parseur de pd.read_excel: memes types, NaN et noms de colonnes dupliquees
+    return clean_dataframe(TextParser([header] + rows, header=0).read())
+
+def iter_sheet_chunks(wb, sheet_name, chunk_rows):
+    """ DataFrames nettoyes successifs d'au plus chunk_rows lignes d'une feuille, avec l'en-tete de la premiere ligne """
+    ws = wb[sheet_name]
+    ws.reset_dimensions()
+
+    header = None
+    chunk = []
+    for row in ws.rows:
+        values = [convert_cell(cell) for cell in row]
+        while values and values[-1] == "":
+            values.pop()
+
+        if header is None:
+            if values:
+                header = values
+            continue
+        # lignes vides ignorees comme par pd.read_excel (skip_blank_lines)
+        if not values:
+            continue
+
+        # les cellules au-dela de l'en-tete sont ignorees
+        values = values[:len(header)] + [""] * (len(header) - len(values))
+        chunk.append(values)
+        if len(chunk) >= chunk_rows:
+            yield rows_to_dataframe(header, chunk)
+            chunk = []
+
+    if chunk:
+        yield rows_to_dataframe(header, chunk)
@@ -0,0 +1,103 @@
+import os
+from collections import defaultdict
+import numpy as np
+from rapidfuzz import fuzz, process
+
+MATCH_SCORE_CUTOFF = 70
+# candidats classes conserves par ligne Invariants (le premier renseigne le cost center)
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", 3))
+# au-dela de ce nombre de stations par affilie, les candidats sont pre-filtres par index de tokens
+MATCH_BLOCKING_MIN_CHOICES = int(os.getenv("MATCH_BLOCKING_MIN_CHOICES", 5000))
+# tokens presents dans plus de cette part des stations ("station", "total"...) ignores par le pre-filtre
+MATCH_STOP_TOKEN_RATIO = 0.05
+# taille maximale d'une matrice de scores cdist (lignes x stations), float32
+MATCH_CDIST_MAX_CELLS = 20_000_000
+
+def build_affiliate_station_map(station_name_and_codes):
+    """ {affilie (2 premieres lettres du code): {nom de station en minuscules: code}} """
+    affiliate_station_map = {}
+    for station_name, station_code in station_name_and_codes.items():
+        affiliate = station_code[:2].upper()
+        if affiliate not in affiliate_station_map:
+            affiliate_station_map[affiliate] = {}
+        affiliate_station_map[affiliate][station_name.lower()] = station_code
+    return affiliate_station_map
+
+def rank_candidates(scores, top_k, score_cutoff=MATCH_SCORE_CUTOFF):
+    """ indices des top_k meilleurs scores >= score_cutoff; a score egal, l'ordre des stations est conserve """
+    eligible = np.flatnonzero(scores >= score_cutoff)
+    ranked = eligible[np.argsort(-scores[eligible], kind="stable")]
+    return [(int(index), float(scores[index])) for index in ranked[:top_k]]
+
+def score_all(queries, choices, top_k):
+    """ une matrice cdist par bloc de lignes: chaque nom est compare a toutes les stations de l'affilie """
+    block_rows = max(1, MATCH_CDIST_MAX_CELLS // max(1, len(choices)))
+    ranked = []
+    for start in range(0, len(queries), block_rows):
+        scores = process.cdist(
+            queries[start:start + block_rows], choices,
+            scorer=fuzz.token_set_ratio, score_cutoff=MATCH_SCORE_CUTOFF, dtype=np.float32, workers=-1
+        )
+        ranked.extend(rank_candidates(row, top_k) for row in scores)
+    return ranked
+
+def build_token_index(choices):
+    token_index = defaultdict(list)
+    for index, choice in enumerate(choices):
+        for token in set(choice.split()):
+            token_index[token].append(index)
+    max_postings = max(1, int(len(choices) * MATCH_STOP_TOKEN_RATIO))
+    stop_tokens = {token for token, postings in token_index.items() if len(postings) > max_postings}
+    return token_index, stop_tokens
+
+def block_candidates(query, token_index, stop_tokens):
+    """ stations partageant au moins un token discriminant avec le nom (a defaut, un token frequent) """
+    tokens = set(query.split())
+    selective_tokens = [token for token in tokens if token in token_index and token not in stop_tokens]
+    blocking_tokens = selective_tokens or [token for token in tokens if token in token_index]
+    if not blocking_tokens:
+        return np.array([], dtype=np.int64)
+    return np.unique(np.concatenate([token_index[token] for token in blocking_tokens]))
+
+def score_blocked(queries, choices, top_k):
+    """ grands affilies: chaque nom n'est score que contre les stations retenues par l'index de tokens """
+    token_index, stop_tokens = build_token_index(choices)
+    ranked = []
+    for query in queries:
+        candidates = block_candidates(query, token_index, stop_tokens)
+        if len(candidates) == 0:
+            ranked.append([])
+            continue
+        scores = process.cdist(
+            [query], [choices[index] for index in candidates],
+            scorer=fuzz.token_set_ratio, score_cutoff=MATCH_SCORE_CUTOFF, dtype=np.float32, workers=-1
+        )[0]
+        ranked.append([(int(candidates[index]), score) for index, score in rank_candidates(scores, top_k)])
+    return ranked
+
+def match_stations(rows_to_process, affiliate_station_map, top_k=None):
+    """ [(ligne, nom Invariants, [(code, nom de station, score), ...] du meilleur au moins bon)] par affilie """
+    top_k = top_k or MATCH_TOP_K
+    rows_by_affiliate = defaultdict(list)
+    for row_idx, inv_station_name, inv_affiliate in rows_to_process:
+        rows_by_affiliate[inv_affiliate.upper()].append((row_idx, inv_station_name))
+
+    matches = []
+    for affiliate, affiliate_rows in rows_by_affiliate.items():
+        affiliate_stations = affiliate_station_map.get(affiliate)
+        if not affiliate_stations:
+            continue
+
+        choices = list(affiliate_stations.keys())
+        queries = [inv_station_name.lower() for _, inv_station_name in affiliate_rows]
+        if len(choices) > MATCH_BLOCKING_MIN_CHOICES:
+            ranked = score_blocked(queries, choices, top_k)
+        else:
+            ranked = score_all(queries, choices, top_k)
+
+        for (row_idx, inv_station_name), candidates in zip(affiliate_rows, ranked):
+            if candidates:
+                matches.append((row_idx, inv_station_name, [
+                    (affiliate_stations[choices[index]], choices[index], score) for index, score in candidates
+                ]))
+    return matches
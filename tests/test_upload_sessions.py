@@ -0,0 +1,88 @@
+import hashlib
+import importlib
+import io
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+class FailingStream(io.RawIOBase):
+    """ corps de requete qui se coupe apres fail_after octets (deconnexion du client) """
+
+    def __init__(self, data, fail_after):
+        self.data = data
+        self.fail_after = fail_after
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = offset if whence == io.SEEK_SET else len(self.data) + offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.fail_after:
+            raise OSError("connexion interrompue")
+        size = min(len(buffer), self.fail_after - self.position)
+        buffer[:size] = self.data[self.position:self.position + size]
+        self.position += size
+        return size
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # base SQLite et worker de jobs arrete: seules les routes de depot sont exercees
+    monkeypatch.chdir(tmp_path)
+    import db as db_module
+    import init as init_module
+    import jobs as jobs_module
+    monkeypatch.setattr(db_module, "get_db_uri", lambda: f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setattr(init_module, "init_db", lambda app, db, bcrypt: None)
+    monkeypatch.setattr(jobs_module.JobQueue, "start", lambda self: None)
+    monkeypatch.setattr(jobs_module.JobQueue, "enqueue", lambda self, kind, payload=None, user_id=None: 1)
+    sys.modules.pop("app", None)
+    app_module = importlib.import_module("app")
+    monkeypatch.setattr(app_module, "validate_report_workbook", lambda file_path: [])
+    with app_module.app.app_context():
+        app_module.db.create_all()
+    yield app_module.app.test_client()
+    sys.modules.pop("app", None)
+
+
+def test_interrupted_chunk_is_resumed_with_the_file_hash(client):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    response = client.post("/upload-sessions?user_id=1", json={"filename": "rapport.xlsx", "size": len(data)})
+    upload_id = response.get_json()["upload_id"]
+    url = f"/upload-sessions/{upload_id}?user_id=1"
+
+    first_chunk = 1024 * 1024
+    response = client.put(url, data=data[:first_chunk], headers={"Upload-Offset": "0"})
+    assert response.get_json()["offset"] == first_chunk
+
+    # le deuxieme morceau est coupe: les octets deja recus restent acquis
+    client.put(
+        url, input_stream=FailingStream(data[first_chunk:], 1024 * 1024 + 8),
+        content_length=len(data) - first_chunk, headers={"Upload-Offset": str(first_chunk)}
+    )
+    offset = client.get(url).get_json()["offset"]
+    assert first_chunk < offset < len(data)
+
+    response = client.put(url, data=data[offset:], headers={"Upload-Offset": str(offset)})
+    assert response.get_json()["offset"] == len(data)
+
+    response = client.post(f"/upload-sessions/{upload_id}/complete?user_id=1")
+    assert response.status_code == 201
+    assert response.get_json()["content_hash"] == hashlib.sha256(data).hexdigest()
+    with open(response.get_json()["path"], "rb") as uploaded:
+        assert uploaded.read() == data
@@ -0,0 +1,50 @@
+from openpyxl import load_workbook
+from constants import REPORT_SHEET_SCHEMA
+
+# lignes lues au debut de chaque feuille pour trouver l'en-tete (premiere ligne non vide, comme l'extraction)
+HEADER_SCAN_ROWS = 10
+
+def read_header(ws):
+    """ en-tete d'une feuille, en minuscules et sans espaces, comme clean_dataframe de l'extraction """
+    for row in ws.iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True):
+        header = [str(value).strip().lower() for value in row if value is not None and str(value).strip() != ""]
+        if header:
+            return header
+    return []
+
+def resolve_sheet_name(sheetnames, sheet_name):
+    """ meme repli que l'extraction: premiere feuille si "Inspections" est absente """
+    if sheet_name in sheetnames:
+        return sheet_name
+    if sheet_name == "Inspections" and sheetnames:
+        return sheetnames[0]
+    return None
+
+def validate_report_workbook(file_path):
+    """ verifie les feuilles et colonnes de REPORT_SHEET_SCHEMA sans lire les donnees; renvoie la liste des erreurs """
+    # ouvert par objet fichier: les depots en cours sont des ".part", refuses par openpyxl d'apres l'extension
+    with open(file_path, 'rb') as workbook_file:
+        # un classeur corrompu peut lever n'importe quelle erreur (zip, XML, parties manquantes...): il est refuse, pas une 500
+        try:
+            wb = load_workbook(workbook_file, read_only=True, data_only=True)
+        except Exception as e:
+            return [f"Classeur Excel (.xlsx) illisible: {e}"]
+        try:
+            return check_report_schema(wb)
+        except Exception as e:
+            return [f"Classeur Excel (.xlsx) illisible: {e}"]
+        finally:
+            wb.close()
+
+def check_report_schema(wb):
+    errors = []
+    for sheet_name, required_columns in REPORT_SHEET_SCHEMA.items():
+        source_name = resolve_sheet_name(wb.sheetnames, sheet_name)
+        if source_name is None:
+            errors.append(f"Feuille '{sheet_name}' manquante")
+            continue
+        header = read_header(wb[source_name])
+        missing = [col for col in required_columns if col not in header]
+        if missing:
+            errors.append(f"Feuille '{source_name}': colonne(s) manquante(s) {', '.join(missing)}")
+    return errors